@@ -0,0 +1,26 @@
+"""
+ASGI config for backend project.
+
+Django 2.2 and Django REST framework 3.9 have no async views, so every
+view stays synchronous. This serves the WSGI application to ASGI servers
+such as uvicorn or daphne through asgiref, which runs each request in a
+worker thread:
+
+    uvicorn backend.asgi:application
+
+More than one worker process needs shared caches (see CACHES in
+settings.py), and WEB_CONCURRENCY, which uvicorn takes as its worker
+count, set so the app can check for them:
+
+    WEB_CONCURRENCY=4 DJANGO_MEMCACHED_LOCATION=127.0.0.1:11211 \
+        uvicorn backend.asgi:application
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+application = WsgiToAsgi(get_wsgi_application())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -46,6 +47,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'pugorugh.middleware.RequestMetricsMiddleware',
+    'pugorugh.middleware.GZipLargeResponseMiddleware',
+    'pugorugh.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,12 +83,134 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DJANGO_DB_PROFILE picks the database:
+#  * 'sqlite' (default) for a single node. Connections use WAL journaling
+#    so reads do not block the writer, and a writer waits up to
+#    SQLITE_BUSY_TIMEOUT seconds for the lock instead of failing with
+#    "database is locked".
+#  * 'postgresql' for concurrent writers, configured with the POSTGRES_*
+#    variables (needs psycopg2). Connections persist for CONN_MAX_AGE
+#    seconds and are checked at the start of each request.
+
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'pugorugh'),
+            'USER': os.environ.get('POSTGRES_USER', 'pugorugh'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+    DB_HEALTH_CHECKS = True
+else:
+    SQLITE_BUSY_TIMEOUT = 20
+    # The demo database checked in with the project
+    BUNDLED_SQLITE_PATH = os.path.join(BASE_DIR, 'db.sqlite3')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_SQLITE_PATH', BUNDLED_SQLITE_PATH),
+            'OPTIONS': {
+                'timeout': SQLITE_BUSY_TIMEOUT,
+            },
+        }
+    }
+    SQLITE_WAL = True
+    # WAL is recorded in the database file, so the checked in one keeps its
+    # rollback journal. Point DJANGO_SQLITE_PATH at a copy to use WAL.
+    SQLITE_WAL_EXCLUDED_PATHS = (BUNDLED_SQLITE_PATH,)
+
+# Read replicas, listed in DJANGO_SQLITE_REPLICA_PATHS or
+# POSTGRES_REPLICA_HOSTS (comma separated), take the reads. A user's reads
+# go to the primary for REPLICA_PIN_SECONDS after they write, so they
+# always see their own swipes. See pugorugh/routers.py.
+if DB_PROFILE == 'postgresql':
+    REPLICA_SETTINGS = [{'HOST': host} for host in os.environ.get(
+        'POSTGRES_REPLICA_HOSTS', '').split(',') if host]
+else:
+    REPLICA_SETTINGS = [{'NAME': name} for name in os.environ.get(
+        'DJANGO_SQLITE_REPLICA_PATHS', '').split(',') if name]
+
+DATABASE_REPLICAS = []
+for number, replica in enumerate(REPLICA_SETTINGS, 1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                            **replica)
+    DATABASE_REPLICAS.append(alias)
+
+# The pins are kept in the STAMP_CACHE_ALIAS cache. Every server process
+# must share it (see CACHES), or a user's next request on another process
+# could read a replica still missing their swipe.
+DATABASE_ROUTERS = ['pugorugh.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# 'default' holds the per-user next-dog candidate queues and the cached
+# API tokens, DOG_CACHE_ALIAS the serialized dog payloads and
+# STAMP_CACHE_ALIAS the version stamps of the catalog and of each user's
+# statuses and preferences, and the replica pins. The stamps have an alias
+# of their own, never culled, since every process rebuilds its dog
+# indexes when they go missing.
+#
+# The local memory caches are only seen by their own process. Running
+# more than one (WEB_CONCURRENCY, which uvicorn and gunicorn read for
+# their worker count, above 1) needs shared caches: set
+# DJANGO_MEMCACHED_LOCATION (comma separated, needs python-memcached).
+# The app refuses to start with more than one process and local caches.
+
+SERVER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+MEMCACHED_LOCATION = os.environ.get('DJANGO_MEMCACHED_LOCATION')
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+            'KEY_PREFIX': alias,
+        }
+        for alias in ('default', 'dogs', 'stamps')
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pugorugh',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'dogs': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pugorugh-dogs',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+        'stamps': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pugorugh-stamps',
+            # A few entries per user, and never culled
+            'OPTIONS': {'MAX_ENTRIES': 2 ** 62},
+        },
+    }
+
+DOG_CACHE_ALIAS = 'dogs'
+STAMP_CACHE_ALIAS = 'stamps'
+
+
+# Request metrics
+# Every request's latency, query count, SQL time and render time are
+# added up per route in each process, and served in the Prometheus text
+# format at /api/stats/metrics/ to the addresses below.
+
+REQUEST_METRICS = True
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
 
 
 # Password validation
@@ -111,12 +237,28 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'pugorugh.authentication.CachedTokenAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
 
-    )
+    ),
+    # JSON first, so it stays the answer to Accept: */*
+    'DEFAULT_RENDERER_CLASSES': [
+        'pugorugh.renderers.FastJSONRenderer',
+    ] + ([
+        'pugorugh.renderers.MessagePackRenderer',
+    ] if importlib.util.find_spec('msgpack') else []) + [
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Responses at least this big are gzipped for clients accepting it; None
+# turns it off
+GZIP_MIN_BYTES = 1024
+
+# Seconds an API token is trusted from the cache before it is looked up
+# again
+TOKEN_CACHE_TIMEOUT = 300
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
@@ -137,6 +279,47 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# 'production' serves content-hashed, precompressed copies of the static
+# files with far-future cache headers. Run collectstatic after every
+# deploy (and after process_dog_images) before starting the server. Dogs
+# point at their original photos until their resized copies are collected.
+# Installing the brotli package adds .br copies next to the .gz ones.
+STATIC_PROFILE = os.environ.get('DJANGO_STATIC_PROFILE', 'development')
+
+# collectstatic gathers files here, and WhiteNoise serves them from here
+# outside of DEBUG. In development the default folder is only used once
+# it exists, since WhiteNoise warns about a missing one on every start.
+STATIC_ROOT = os.environ.get('DJANGO_STATIC_ROOT')
+if STATIC_ROOT is None:
+    default_static_root = os.path.join(BASE_DIR, 'staticfiles')
+    if (STATIC_PROFILE == 'production' or not DEBUG or
+            os.path.isdir(default_static_root)):
+        STATIC_ROOT = default_static_root
+
+if STATIC_PROFILE == 'production':
+    STATICFILES_STORAGE = (
+        'whitenoise.storage.CompressedManifestStaticFilesStorage')
+    # Unhashed copies stay for the icon paths in the React code, which
+    # are cached for a day
+    WHITENOISE_MAX_AGE = 24 * 60 * 60
+
+# Find the dogs matching a user's preferences in sorted arrays of ids
+# per preference combination, held in each process, instead of scanning
+# the catalog. ELIGIBLE_DOG_COMBOS is how many combinations each process
+# keeps.
+ELIGIBLE_DOG_INDEX = True
+ELIGIBLE_DOG_COMBOS = 64
+
+# Keep each user's liked and disliked dog ids as bitmaps in every
+# process, for up to STATUS_INDEX_USERS users, so the next dog and status
+# lists do not join the dogs to the user's statuses. Suits users with very
+# long swipe histories.
+STATUS_INDEX = False
+STATUS_INDEX_USERS = 1000
+
+# Resize the photo of each new dog in a background thread (needs Pillow)
+PROCESS_DOG_IMAGES_ON_CREATE = True
+
 # Additional locations of static files
 STATICFILES_DIRS = (
     os.path.join(os.path.dirname(__file__), '../pugorugh/static/'),
@@ -1,7 +1,77 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
 from . import models
 
-# Register your models here.
-admin.site.register(models.Dog)
-admin.site.register(models.UserDog)
-admin.site.register(models.UserPref)
\ No newline at end of file
+
+class EstimatedCountPaginator(Paginator):
+    """ Pages through big tables without counting every row.
+
+    An unfiltered list takes its size from the database's own estimate,
+    and a filtered one is counted up to ``max_count`` rows. Small tables
+    are counted exactly.
+    """
+    exact_below = 10000
+    max_count = 100000
+
+    def estimate(self):
+        model = self.object_list.model
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [model._meta.db_table])
+            elif connection.vendor == 'sqlite':
+                # The highest id, found from the primary key alone
+                cursor.execute('SELECT MAX({}) FROM {}'.format(
+                    connection.ops.quote_name(model._meta.pk.column),
+                    connection.ops.quote_name(model._meta.db_table)))
+            else:
+                return None
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = self.estimate()
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+            return super(EstimatedCountPaginator, self).count
+        return self.object_list[:self.max_count].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the second COUNT(*) of the whole table on filtered lists
+    show_full_result_count = False
+
+
+@admin.register(models.Dog)
+class DogAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'breed', 'age', 'age_stage', 'gender',
+                    'size')
+    list_filter = ('age_stage',)
+
+
+@admin.register(models.UserDog)
+class UserDogAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'dog', 'status')
+    list_select_related = ('user', 'dog')
+    raw_id_fields = ('user', 'dog')
+
+
+@admin.register(models.UserPref)
+class UserPrefAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'age', 'gender', 'size')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(models.UserStatusCount)
+class UserStatusCountAdmin(LargeTableAdmin):
+    list_display = ('user', 'liked', 'disliked')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
@@ -1,5 +1,30 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+# Cache backends only their own process sees
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def check_shared_caches():
+    """Refuse to run several server processes on caches each keeps to
+    itself, where one process would never see the payloads another
+    invalidated or the version stamps it moved on."""
+    local = sorted(alias for alias, config in settings.CACHES.items()
+                   if config['BACKEND'] in PROCESS_LOCAL_CACHES)
+    if getattr(settings, 'SERVER_PROCESSES', 1) > 1 and local:
+        raise ImproperlyConfigured(
+            'WEB_CONCURRENCY runs {} processes, but the {} cache{} only '
+            'seen by its own process. Set DJANGO_MEMCACHED_LOCATION or '
+            'configure shared CACHES.'.format(
+                settings.SERVER_PROCESSES, ', '.join(local),
+                's are each' if len(local) > 1 else ' is'))
 
 
 class PugorughConfig(AppConfig):
     name = 'pugorugh'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        check_shared_caches()
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.authentication import TokenAuthentication
+
+from . import routers
+
+
+def token_cache_key(key):
+    return 'pugorugh:token:{}'.format(key)
+
+
+def user_token_cache_key(user_id):
+    return 'pugorugh:user-token:{}'.format(user_id)
+
+
+def evict_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def evict_user(user_id):
+    """Drop the cached token of the given user, if there is one"""
+    key = cache.get(user_token_cache_key(user_id))
+    if key is not None:
+        cache.delete_many([token_cache_key(key), user_token_cache_key(user_id)])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Token authentication that remembers tokens for a while.
+
+    A cached token skips the token and user lookup. Entries expire after
+    TOKEN_CACHE_TIMEOUT seconds and are evicted when the token is deleted
+    or its user is saved (see ``signals.py``). Users who wrote recently
+    read from the primary database (see ``routers.py``).
+    """
+
+    def authenticate_credentials(self, key):
+        cached = cache.get(token_cache_key(key))
+        if cached is None:
+            # From the primary, as a replica may not have a new token yet
+            with routers.use_primary():
+                cached = super(CachedTokenAuthentication,
+                               self).authenticate_credentials(key)
+            user, token = cached
+            timeout = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300)
+            cache.set_many({
+                token_cache_key(key): (user, token),
+                user_token_cache_key(user.id): key,
+            }, timeout)
+
+        routers.read_own_writes(cached[0].id)
+        return cached
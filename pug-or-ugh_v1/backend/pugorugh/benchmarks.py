@@ -0,0 +1,427 @@
+"""Query count, latency and memory benchmarks for the pugorugh routes.
+
+``seed`` fills the current database with a synthetic catalog and users
+with swipe histories, and ``run`` drives every route through the Django
+test client. The ``benchmark`` management command does both against a
+throwaway test database and writes the report as JSON.
+"""
+import gzip
+import itertools
+import multiprocessing
+import random
+import re
+import time
+import tracemalloc
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection, connections
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import compress_string
+
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import dog_cache
+from . import models
+from . import ranking
+from . import renderers
+
+
+BATCH_SIZE = 5000
+PASSWORD = 'benchmark'
+
+BREEDS = ('Labrador', 'French Bulldog', 'Boxer', 'Swedish Vallhund',
+          'Beagle', 'Pug', 'Poodle', 'Greyhound', 'Husky', 'Dachshund')
+GENDERS = ('m', 'f')
+SIZES = ('s', 'm', 'l', 'xl')
+
+
+def seed(dogs=1000, users=10, swipes=100, random_seed=0):
+    """Add a synthetic catalog and users with swipe histories.
+
+    Returns the benchmark user, a staff user with the password
+    ``PASSWORD``, ``swipes`` liked or disliked dogs and preferences that
+    match the whole catalog.
+    """
+    rand = random.Random(random_seed)
+
+    for start in range(0, dogs, BATCH_SIZE):
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number),
+                       image_filename='{}.jpg'.format(number % 19 + 1),
+                       breed=rand.choice(BREEDS),
+                       age=rand.randint(0, 180),
+                       gender=rand.choice(GENDERS),
+                       size=rand.choice(SIZES))
+            for number in range(start, min(start + BATCH_SIZE, dogs))
+        ])
+    dog_ids = list(models.Dog.objects.values_list('id', flat=True))
+
+    User = get_user_model()
+    User.objects.bulk_create([
+        User(username='bench{}'.format(number)) for number in range(users)
+    ])
+    bench_users = list(User.objects.filter(username__startswith='bench')
+                       .order_by('id'))
+    Token.objects.bulk_create([
+        Token(key=Token().generate_key(), user=user) for user in bench_users
+    ])
+    models.UserPref.objects.bulk_create([
+        models.UserPref(user=user, gender='m,f', age='b,y,a,s',
+                        size='s,m,l,xl')
+        for user in bench_users
+    ])
+
+    for user in bench_users:
+        user_dogs = [
+            models.UserDog(user=user, dog_id=dog_id,
+                           status=rand.choice(('l', 'd')))
+            for dog_id in rand.sample(dog_ids, min(swipes, len(dog_ids)))
+        ]
+        models.UserDog.objects.bulk_create(user_dogs)
+    models.UserStatusCount.objects.rebuild(BATCH_SIZE)
+
+    bench_user = bench_users[0]
+    bench_user.is_staff = True
+    bench_user.set_password(PASSWORD)
+    bench_user.save()
+    return bench_user
+
+
+def get_scenarios(user):
+    """Return (name, method, path, data) for every route to measure.
+
+    The data may be a function, called for a fresh body on every request.
+    """
+    liked = (models.UserDog.objects.filter(user=user, status='l')
+             .values_list('dog_id', flat=True).first())
+    some_dogs = list(models.Dog.objects.values_list('id', flat=True)[:50])
+    dog_id = some_dogs[0]
+
+    def status_url(status):
+        return reverse('UpdateStatus', kwargs={'pk': dog_id, 'status': status})
+
+    def next_url(status, pk=-1):
+        return reverse('NextDog', kwargs={'pk': pk, 'status': status})
+
+    new_usernames = ('new{}'.format(number) for number in itertools.count())
+
+    return [
+        ('api-root', 'get', reverse('api-root'), None),
+        ('login-user', 'post', reverse('login-user'),
+         {'username': user.username, 'password': PASSWORD}),
+        ('register-user', 'post', reverse('register-user'),
+         lambda: {'username': next(new_usernames), 'password': PASSWORD}),
+        ('user-pref', 'get', reverse('user-pref'), None),
+        ('user-pref', 'put', reverse('user-pref'),
+         {'gender': 'm,f', 'age': 'b,y,a,s', 'size': 's,m,l,xl'}),
+        ('UpdateStatus:liked', 'put', status_url('liked'), None),
+        ('UpdateStatus:undecided', 'put', status_url('undecided'), None),
+        ('UpdateStatuses', 'post', reverse('UpdateStatuses'),
+         [{'dog': pk, 'status': 'disliked'} for pk in some_dogs]),
+        ('NextDog:undecided', 'get', next_url('undecided'), None),
+        ('NextDog:undecided:ranked', 'get',
+         next_url('undecided') + '?order=ranked', None),
+        ('NextDog:liked', 'get', next_url('liked'), None),
+        ('NextDog:liked-after', 'get', next_url('liked', liked or -1), None),
+        ('NextDog:disliked', 'get', next_url('disliked'), None),
+        ('ListDogs:page', 'get', reverse('ListDogs') + '?page_size=100', None),
+        ('ListDogs:page:msgpack', 'get',
+         reverse('ListDogs') + '?page_size=100&format=msgpack', None),
+        ('ListDogsStatus:liked', 'get',
+         reverse('ListDogsStatus', kwargs={'status': 'liked'}), None),
+        ('ListDogsStatus:undecided:page', 'get',
+         reverse('ListDogsStatus', kwargs={'status': 'undecided'}) +
+         '?page_size=100', None),
+        ('DogStatusSummary', 'get', reverse('DogStatusSummary'), None),
+        ('SearchDogs:breed', 'get', reverse('SearchDogs') + '?breed=lab',
+         None),
+        ('SearchDogs:breed:filtered', 'get', reverse('SearchDogs') +
+         '?breed=bull&gender=f&size=s&age=b', None),
+        ('SearchDogs:fuzzy', 'get', reverse('SearchDogs') +
+         '?breed=labrdor&fuzzy=1', None),
+        ('SearchDogs:name', 'get', reverse('SearchDogs') + '?name=dog+12345',
+         None),
+        ('SearchDogs:name:breed', 'get', reverse('SearchDogs') +
+         '?name=dog+1&breed=pug', None),
+        ('DogCacheStats', 'get', reverse('DogCacheStats'), None),
+        ('Metrics', 'get', reverse('Metrics'), None),
+        ('index', 'get', '/', None),
+    ]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100 * (len(values) - 1)))]
+
+
+def measure(client, method, path, data, repeat):
+    """Time one route and count its queries and peak memory."""
+    def call():
+        if data is None:
+            return getattr(client, method)(path)
+        body = data() if callable(data) else data
+        return getattr(client, method)(path, body, format='json')
+
+    with CaptureQueriesContext(connection) as context:
+        response = call()
+    queries = len(context)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': queries,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+STATIC_REFERENCE = re.compile(r'(?:src|href)="(/static/[^"]+)"')
+
+
+def cold_page_load(client, path='/', encoding='gzip, deflate, br'):
+    """Fetch a page and every static file it references, as a browser
+    with an empty cache would, and return the bytes sent for each."""
+    response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+    page = response.content
+    if response.get('Content-Encoding') == 'gzip':
+        page = gzip.decompress(page)
+    files = []
+    for url in STATIC_REFERENCE.findall(page.decode()):
+        asset = client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+        if asset.streaming:
+            body = b''.join(asset.streaming_content)
+        else:
+            body = asset.content
+        asset.close()
+        files.append({
+            'url': url,
+            'status': asset.status_code,
+            'bytes': len(body),
+            'content_encoding': asset.get('Content-Encoding', ''),
+            'cache_control': asset.get('Cache-Control', ''),
+        })
+    return {
+        'path': path,
+        'page_bytes': len(response.content),
+        'total_bytes': len(response.content) + sum(
+            file['bytes'] for file in files),
+        'files': files,
+    }
+
+
+def run(user, repeat=50):
+    """Measure every route as the given user and return the results."""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+    token = Token.objects.get(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    # Warm the token cache so every route is measured the same way
+    client.get(reverse('api-root'))
+
+    results = []
+    for name, method, path, data in get_scenarios(user):
+        result = {'name': name, 'method': method.upper(), 'path': path}
+        result.update(measure(client, method, path, data, repeat))
+        results.append(result)
+    return results
+
+
+def render_timings(dogs=10000, repeat=10):
+    """Time rendering a list of dogs with each renderer, and gzipping the
+    result, and count the bytes of both."""
+    dog_ids = list(models.Dog.objects.order_by('id')
+                   .values_list('id', flat=True)[:dogs])
+    payloads = dog_cache.get_payloads(dog_ids)
+    results = []
+    for name, renderer in (('drf-json', JSONRenderer()),
+                           ('fast-json', renderers.FastJSONRenderer()),
+                           ('msgpack', renderers.MessagePackRenderer())):
+        if name == 'msgpack' and renderers.msgpack is None:
+            continue
+        render_timings = []
+        gzip_timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = renderer.render(payloads, renderer.media_type, {})
+            render_timings.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            compressed = compress_string(body)
+            gzip_timings.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'renderer': name,
+            'dogs': len(payloads),
+            'render_p50_ms': round(percentile(render_timings, 50), 3),
+            'bytes': len(body),
+            'gzip_p50_ms': round(percentile(gzip_timings, 50), 3),
+            'gzip_bytes': len(compressed),
+        })
+    return results
+
+
+def score_rows(liked, dogs):
+    """Score dog rows against liked ones a row at a time, the way
+    ranking.py would without NumPy."""
+    shares = {feature: Counter(ranking.normalize(feature, row[feature])
+                               for row in liked)
+              for feature in ranking.FEATURES}
+    shares['breed'].pop('', None)
+    return [sum(ranking.WEIGHTS[feature] *
+                shares[feature][ranking.normalize(feature, row[feature])] /
+                len(liked)
+                for feature in ranking.FEATURES)
+            for row in dogs]
+
+
+def ranking_timings(user, pools=(1000, 10000), repeat=20):
+    """Time scoring pools of undecided dogs against the user's likes with
+    the feature matrix and row by row in Python."""
+    liked_ids = list(models.UserDog.objects.filter(user=user, status='l')
+                     .values_list('dog_id', flat=True))
+    liked = list(models.Dog.objects.filter(id__in=liked_ids)
+                 .values(*ranking.FEATURES))
+    results = []
+    for pool in pools:
+        dog_ids = list(models.Dog.objects.with_status(user, None)
+                       .order_by('id').values_list('id', flat=True)[:pool])
+        dogs = list(models.Dog.objects.filter(id__in=dog_ids).order_by('id')
+                    .values(*ranking.FEATURES))
+        # Builds the matrix
+        ranking.rank(liked_ids, dog_ids, 1)
+
+        result = {'candidates': len(dog_ids), 'liked': len(liked_ids)}
+        if ranking.available():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                ranking.rank(liked_ids, dog_ids, 1)
+                timings.append((time.perf_counter() - started) * 1000)
+            result['numpy_p50_ms'] = round(percentile(timings, 50), 3)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            scores = score_rows(liked, dogs)
+            max(range(len(scores)), key=scores.__getitem__, default=None)
+            timings.append((time.perf_counter() - started) * 1000)
+        result['python_p50_ms'] = round(percentile(timings, 50), 3)
+        results.append(result)
+    return results
+
+
+def swipe_writer(token_key, dog_ids, swipes, random_seed, batch_size=5):
+    """Swipe random dogs through the API as one user, in its own process.
+
+    Every other request posts a batch of batch_size swipes to the batch
+    endpoint instead of one swipe. Returns the request timings in
+    milliseconds and the number of failed requests.
+    """
+    rand = random.Random(random_seed)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token_key)
+    statuses = ('liked', 'disliked', 'undecided')
+
+    timings = []
+    errors = 0
+    try:
+        for number in range(swipes):
+            started = time.perf_counter()
+            try:
+                if number % 2:
+                    response = client.post(reverse('UpdateStatuses'), [
+                        {'dog': rand.choice(dog_ids),
+                         'status': rand.choice(statuses)}
+                        for _ in range(batch_size)
+                    ], format='json')
+                else:
+                    response = client.put(reverse('UpdateStatus', kwargs={
+                        'pk': rand.choice(dog_ids),
+                        'status': rand.choice(statuses),
+                    }))
+            except Exception:
+                errors += 1
+            else:
+                errors += response.status_code != 200
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        connections.close_all()
+    return timings, errors
+
+
+def status_counts_match():
+    """Whether every user's kept status counts match their UserDog rows"""
+    kept = {(count.user_id, count.liked, count.disliked)
+            for count in models.UserStatusCount.objects.all()
+            if count.liked or count.disliked}
+    actual = {(count['user_id'], count['liked'], count['disliked'])
+              for count in models.UserDog.objects.filter(
+                  status__isnull=False).values('user_id').annotate(
+                  liked=Count('id', filter=Q(status='l')),
+                  disliked=Count('id', filter=Q(status='d'))).order_by()}
+    return kept == actual
+
+
+def concurrent_swipes(writers=8, swipes=100, dogs=1000):
+    """Run many swipe writers at once against the current database.
+
+    Each writer is a separate process with its own user and connection,
+    like a worker of a multi-process server, and alternates single swipes
+    with batches. The database must be one the processes can share, so
+    not an in-memory SQLite database.
+    """
+    seed(dogs=dogs, users=writers, swipes=0)
+    dog_ids = list(models.Dog.objects.values_list('id', flat=True))
+    token_keys = list(Token.objects.filter(user__username__startswith='bench')
+                      .order_by('user_id').values_list('key', flat=True))
+
+    journal_mode = None
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+
+    # Forked writers must not share the parent's connection
+    connections.close_all()
+    started = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(writers) as pool:
+        results = pool.starmap(swipe_writer, [
+            (token_key, dog_ids, swipes, number)
+            for number, token_key in enumerate(token_keys)
+        ])
+    elapsed = time.perf_counter() - started
+
+    timings = [timing for writer_timings, errors in results
+               for timing in writer_timings]
+    return {
+        'database': connection.vendor,
+        'journal_mode': journal_mode,
+        'writers': writers,
+        'swipes': len(timings),
+        'errors': sum(errors for writer_timings, errors in results),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'user_dogs': models.UserDog.objects.count(),
+        'counts_match': status_counts_match(),
+    }
+
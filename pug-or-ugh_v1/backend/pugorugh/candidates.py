@@ -0,0 +1,155 @@
+"""A per-user queue of upcoming undecided dog ids.
+
+The queue lives in the Django cache and holds every undecided dog id
+matching the user's preferences in the id range ``(start, last]``. A
+request for the dog after ``pk`` drops the ids up to ``pk`` and serves
+the next one, so the database is only asked for candidates once every
+``CHUNK_SIZE`` swipes. Matching dogs come from the eligible dog index
+(see ``eligible.py``) unless the ``ELIGIBLE_DOG_INDEX`` setting is off.
+
+Ranked requests skip the queue and order the first ``RANKED_POOL``
+undecided dogs by the user's likes (see ``ranking.py``). The dogs the
+user skipped since starting a ranked walk are kept in the cache too and
+left out of the pool, so the walk moves on.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import eligible
+from . import models
+from . import ranking
+from . import status_index
+
+
+CHUNK_SIZE = 50
+# Most matching ids checked against the user's statuses at once
+MAX_WINDOW = 5000
+# Undecided dogs ranked for each ranked request
+RANKED_POOL = 2000
+TIMEOUT = 60 * 60
+
+
+def cache_key(user):
+    return 'pugorugh:candidates:{}'.format(user.id)
+
+
+def ranked_cache_key(user):
+    return 'pugorugh:ranked-skipped:{}'.format(user.id)
+
+
+def fetch_candidates(user, after, count=CHUNK_SIZE):
+    """Return the next count undecided dog ids after the given id."""
+    user_pref = user.userpref_set.get()
+    if not getattr(settings, 'ELIGIBLE_DOG_INDEX', True):
+        return list(models.Dog.objects.matching(user_pref)
+                    .with_status(user, None)
+                    .filter(id__gt=after)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:count])
+
+    # Matching ids come from the index, a window at a time, leaving out
+    # the ones the user decided
+    statuses = status_index.get(user)
+    dog_ids = []
+    window = min(count, MAX_WINDOW)
+    while len(dog_ids) < count:
+        matching = eligible.ids_after(user_pref, after, window)
+        if not matching:
+            break
+        if statuses is not None:
+            decided = statuses
+        else:
+            decided = set(models.UserDog.objects.filter(
+                user=user,
+                status__in=('l', 'd'),
+                dog_id__gt=after,
+                dog_id__lte=matching[-1],
+            ).values_list('dog_id', flat=True))
+        dog_ids.extend(dog_id for dog_id in matching
+                       if dog_id not in decided)
+        after = matching[-1]
+        window = min(window * 2, MAX_WINDOW)
+    return dog_ids[:count]
+
+
+def next_dog_id(user, pk):
+    """Return the id of the first undecided dog after pk, or None."""
+    dog_ids = next_dog_ids(user, pk)
+    return dog_ids[0] if dog_ids else None
+
+
+def next_dog_ids(user, pk, count=1):
+    """Return the ids of up to count undecided dogs after pk."""
+    queue = cache.get(cache_key(user))
+    if queue is None or pk < queue['start']:
+        queue = {'start': pk, 'last': pk, 'ids': []}
+
+    queue['ids'] = [dog_id for dog_id in queue['ids'] if dog_id > pk]
+    queue['start'] = max(queue['start'], pk)
+    queue['last'] = max(queue['last'], pk)
+
+    while len(queue['ids']) < count:
+        more = fetch_candidates(user, queue['last'])
+        if not more:
+            break
+        queue['ids'].extend(more)
+        queue['last'] = more[-1]
+
+    cache.set(cache_key(user), queue, TIMEOUT)
+    return queue['ids'][:count]
+
+
+def ranked_dog_ids(user, pk, count=1):
+    """Return the ids of up to count undecided dogs, the best match to the
+    user's liked dogs first.
+
+    A pk of -1 starts a new walk. Otherwise pk is the dog the user is
+    skipping, and it and the dogs skipped before it in the walk are left
+    out.
+    """
+    if pk < 0:
+        skipped = set()
+    else:
+        skipped = cache.get(ranked_cache_key(user), set())
+        skipped.add(pk)
+    cache.set(ranked_cache_key(user), skipped, TIMEOUT)
+
+    pool = [dog_id for dog_id
+            in fetch_candidates(user, -1, RANKED_POOL + len(skipped))
+            if dog_id not in skipped][:RANKED_POOL]
+    statuses = status_index.get(user)
+    if statuses is not None:
+        liked = statuses.ids_after('l', -1)
+    else:
+        liked = models.UserDog.objects.filter(
+            user=user, status='l').values_list('dog_id', flat=True)
+    return ranking.rank(liked, pool, count)
+
+
+def status_changed(user, dog_id, status):
+    """Keep the queue in step with a new status for one dog."""
+    statuses_changed(user, {dog_id: status})
+
+
+def statuses_changed(user, statuses):
+    """Keep the queue in step with new statuses, a dict of dog id to
+    status."""
+    queue = cache.get(cache_key(user))
+    if queue is None:
+        return
+
+    for dog_id, status in statuses.items():
+        # An undecided dog inside the queued range would be missed
+        if status is None and queue['start'] < dog_id <= queue['last']:
+            clear(user)
+            return
+
+    decided = {dog_id for dog_id, status in statuses.items() if status}
+    if decided.intersection(queue['ids']):
+        queue['ids'] = [dog_id for dog_id in queue['ids']
+                        if dog_id not in decided]
+        cache.set(cache_key(user), queue, TIMEOUT)
+
+
+def clear(user):
+    cache.delete(cache_key(user))
@@ -0,0 +1,79 @@
+"""Conditional GETs answered from version stamps.
+
+The dog lists and the preferences are built from things with version
+stamps in the cache: the catalog, each user's statuses and each user's
+preferences (see ``models.py``). Their ETag is a hash of the stamps, so
+a client sending it back in ``If-None-Match`` gets a 304 without the
+list being queried or serialized.
+
+There is no Last-Modified date: it only counts whole seconds, so a
+change in the same second as the client's copy would be answered with
+304, and the clocks of several servers need not agree.
+
+That holds only while every server process sees the same stamps. With
+several processes and a stamp cache each keeps to itself, a swipe made
+in one would leave the stamps of another behind, and it would answer
+304 for a list that changed, so the views then always send it in full.
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import quote_etag
+
+from . import apps
+
+
+def enabled():
+    """Whether a 304 can be trusted: one process, or stamps shared by all
+    of them."""
+    alias = getattr(settings, 'STAMP_CACHE_ALIAS', 'default')
+    backend = settings.CACHES[alias]['BACKEND']
+    return (getattr(settings, 'SERVER_PROCESSES', 1) <= 1 or
+            backend not in apps.PROCESS_LOCAL_CACHES)
+
+
+class ConditionalGetMixin:
+    """ Answers GETs with 304 Not Modified while the view's version stamps
+    match the client's copy.
+
+    Views give the stamps their response is built from with
+    ``get_versions``.
+    """
+
+    def get_versions(self, request):
+        raise NotImplementedError
+
+    def get_etag(self, request):
+        """A hash of the stamps and of everything else choosing what the
+        response holds: the user, the query string and the media type."""
+        validator = repr((
+            self.get_versions(request),
+            request.user.id,
+            request.get_full_path(),
+            request.accepted_media_type,
+        ))
+        return quote_etag(hashlib.sha1(validator.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        if not enabled():
+            return super(ConditionalGetMixin, self).get(
+                request, *args, **kwargs)
+
+        # Read before the response is built, so a change meanwhile can
+        # only make the ETag older than the response, never newer
+        etag = self.get_etag(request)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(
+                request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        # Clients keep their copy but check it on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
@@ -0,0 +1,82 @@
+"""A read-through cache of serialized dog payloads.
+
+Payloads are keyed by dog id and ``PAYLOAD_VERSION``, which should be
+bumped whenever ``DogSerializer`` changes shape. Saving or deleting a dog
+drops its payload (see ``signals.py``). Updates made with
+``QuerySet.update()`` skip the signals, so callers doing that must call
+``invalidate`` themselves.
+
+``invalidate`` drops the payloads again once the transaction commits,
+since a request reading the old rows before then may have cached them
+anew.
+
+The cache alias comes from the ``DOG_CACHE_ALIAS`` setting, so any
+Django cache backend can hold the payloads.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import models
+from . import serializers
+
+
+PAYLOAD_VERSION = 2
+TIMEOUT = 24 * 60 * 60
+# Dogs read from the cache and the database at once, well under SQLite's
+# limit on query parameters
+CHUNK_SIZE = 500
+
+# Hits and misses in this process
+stats = Counter(hits=0, misses=0)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DOG_CACHE_ALIAS', 'default')]
+
+
+def cache_key(dog_id):
+    return 'pugorugh:dog:{}:{}'.format(PAYLOAD_VERSION, dog_id)
+
+
+def get_payloads(dog_ids):
+    """Return the payloads of the given dogs, in the same order.
+
+    Dogs that no longer exist are left out.
+    """
+    dog_ids = list(dog_ids)
+    payloads = []
+    for start in range(0, len(dog_ids), CHUNK_SIZE):
+        payloads.extend(get_chunk(dog_ids[start:start + CHUNK_SIZE]))
+    return payloads
+
+
+def get_chunk(dog_ids):
+    cache = get_cache()
+    cached = cache.get_many([cache_key(dog_id) for dog_id in dog_ids])
+    payloads = {dog_id: cached[cache_key(dog_id)]
+                for dog_id in dog_ids if cache_key(dog_id) in cached}
+
+    missing = [dog_id for dog_id in dog_ids if dog_id not in payloads]
+    stats['hits'] += len(dog_ids) - len(missing)
+    stats['misses'] += len(missing)
+
+    if missing:
+        fresh = {
+            dog.id: dict(serializers.DogSerializer(dog).data)
+            for dog in models.Dog.objects.filter(id__in=missing)
+        }
+        cache.set_many({cache_key(dog_id): payload
+                        for dog_id, payload in fresh.items()}, TIMEOUT)
+        payloads.update(fresh)
+
+    return [payloads[dog_id] for dog_id in dog_ids if dog_id in payloads]
+
+
+def invalidate(dog_ids):
+    """Drop the payloads of the given dogs, now and on commit"""
+    keys = [cache_key(dog_id) for dog_id in dog_ids]
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
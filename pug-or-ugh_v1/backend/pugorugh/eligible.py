@@ -0,0 +1,112 @@
+"""Sorted arrays of the dog ids matching each preference combination.
+
+Every dog falls in one cell of gender, size and age stage, and the index
+keeps a sorted array of ids per cell. The ids matching a set of
+preferences are the merged cells they cover, kept for the most recently
+used ``MAX_COMBOS`` combinations, so finding the dogs after a given id is
+a binary search instead of a filtered scan of the catalog.
+
+Each process has its own index and checks the catalog versions in the
+cache before use. New dogs are added in place; any other change to the
+catalog rebuilds the index on the next lookup, as does a dog committed
+after one with a higher id, which loading only newer ids would miss.
+"""
+import heapq
+import threading
+from array import array
+from bisect import bisect_right, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import router
+
+from . import models
+
+
+MAX_COMBOS = 64
+LOAD_CHUNK_SIZE = 10000
+
+
+def combo_key(user_pref):
+    return (frozenset(user_pref.gender.split(',')),
+            frozenset(user_pref.size.split(',')),
+            frozenset(user_pref.age_stages))
+
+
+class EligibleDogIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.reset()
+
+    def reset(self):
+        self.cells = {}
+        self.combos = OrderedDict()
+        self.last_id = 0
+
+    def add_dogs(self, rows):
+        """Add (id, gender, size, age stage) rows with ids above last_id"""
+        for dog_id, gender, size, age_stage in rows:
+            cell = (gender, size, age_stage)
+            ids = self.cells.setdefault(cell, array('i'))
+            if not ids or ids[-1] < dog_id:
+                ids.append(dog_id)
+            else:
+                insort(ids, dog_id)
+            for key, combo in self.combos.items():
+                if gender in key[0] and size in key[1] and age_stage in key[2]:
+                    insort(combo, dog_id)
+            self.last_id = max(self.last_id, dog_id)
+
+    def load(self, after):
+        # From the primary, since the catalog version may be ahead of
+        # the replicas
+        rows = (models.Dog.objects.using(router.db_for_write(models.Dog))
+                .filter(id__gt=after).order_by('id')
+                .values_list('id', 'gender', 'size', 'age_stage')
+                .iterator(chunk_size=LOAD_CHUNK_SIZE))
+        self.add_dogs(rows)
+
+    def refresh(self):
+        """Catch up with the catalog: load new dogs, or everything again
+        after any other change."""
+        version, changed = models.catalog_versions()
+        if version == self.version:
+            return
+        if self.version is None or changed > self.version:
+            self.reset()
+        self.load(self.last_id)
+        self.version = version
+
+    def get_combo(self, key):
+        combo = self.combos.get(key)
+        if combo is not None:
+            self.combos.move_to_end(key)
+            return combo
+
+        genders, sizes, age_stages = key
+        combo = array('i', heapq.merge(*[
+            ids for (gender, size, age_stage), ids in self.cells.items()
+            if gender in genders and size in sizes and age_stage in age_stages
+        ]))
+        self.combos[key] = combo
+        if len(self.combos) > getattr(settings, 'ELIGIBLE_DOG_COMBOS',
+                                      MAX_COMBOS):
+            self.combos.popitem(last=False)
+        return combo
+
+    def ids_after(self, user_pref, after, count):
+        """Return up to count ids of dogs matching the preferences, in id
+        order, after the given id."""
+        with self.lock:
+            self.refresh()
+            combo = self.get_combo(combo_key(user_pref))
+            start = bisect_right(combo, after)
+            return combo[start:start + count].tolist()
+
+
+index = EligibleDogIndex()
+
+
+def ids_after(user_pref, after, count):
+    return index.ids_after(user_pref, after, count)
@@ -0,0 +1,163 @@
+"""Resized JPEG and WebP derivatives of the dog photos.
+
+Each source image in ``static/images/dogs`` is hashed, and its
+derivatives are written to ``static/images/dogs/derived`` as
+``<hash>-<size>.<format>``. Dogs only record the hash, which is enough to
+build every derivative URL, and the names change whenever the photo does
+so they can be cached forever.
+
+Pillow is needed to make derivatives. Without it dogs keep pointing at
+their original photos. So do dogs whose derivatives are not collected
+yet, when the static files are served from ``STATIC_ROOT``.
+"""
+import hashlib
+import logging
+from os import makedirs, path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestFilesMixin,
+                                                staticfiles_storage)
+from django.templatetags.static import static
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+PROJ_DIR = path.dirname(path.abspath(__file__))
+SOURCE_DIR = path.join(PROJ_DIR, 'static', 'images', 'dogs')
+DERIVED_DIR = path.join(SOURCE_DIR, 'derived')
+
+# Widths in pixels, smallest first
+SIZES = (
+    ('thumb', 320),
+    ('card', 800),
+)
+FORMATS = (
+    ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True}),
+    ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+)
+HASH_LENGTH = 16
+
+
+def content_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def derived_filename(image_hash, size, extension):
+    return '{}-{}.{}'.format(image_hash, size, extension)
+
+
+def source_path(image_filename):
+    """Return the path of a source photo, or None when the filename leads
+    out of SOURCE_DIR, as an absolute path or ``..`` would."""
+    source_dir = path.realpath(SOURCE_DIR)
+    source = path.realpath(path.join(source_dir, image_filename))
+    if path.commonpath([source_dir, source]) != source_dir:
+        return None
+    return source
+
+
+def process_image(image_filename):
+    """Write the derivatives of one source photo and return its hash.
+
+    Returns None when Pillow is missing, the photo cannot be read or it is
+    outside SOURCE_DIR. Derivatives that already exist are not written
+    again.
+    """
+    if Image is None:
+        return None
+
+    source = source_path(image_filename)
+    if source is None:
+        logger.warning('Not making derivatives of %s, which is outside %s',
+                       image_filename, SOURCE_DIR)
+        return None
+    try:
+        image_hash = content_hash(source)
+        targets = [
+            (size, width, extension, options,
+             path.join(DERIVED_DIR,
+                       derived_filename(image_hash, size, extension)))
+            for size, width in SIZES
+            for extension, options in FORMATS
+        ]
+        if all(path.exists(target[-1]) for target in targets):
+            return image_hash
+
+        makedirs(DERIVED_DIR, exist_ok=True)
+        with Image.open(source) as image:
+            image = image.convert('RGB')
+            for size, width, extension, options, target in targets:
+                resized = image.copy()
+                # thumbnail() keeps the aspect ratio and never upscales
+                resized.thumbnail((width, width * 4), Image.LANCZOS)
+                resized.save(target, **options)
+    except OSError:
+        logger.warning('Could not make derivatives of %s', image_filename,
+                       exc_info=True)
+        return None
+
+    return image_hash
+
+
+def process_images(image_filenames, executor):
+    """Process many photos with a ``ProcessPoolExecutor``.
+
+    Returns a dict of image filename to hash, leaving out failures.
+    """
+    image_filenames = list(image_filenames)
+    hashes = executor.map(process_image, image_filenames, chunksize=8)
+    return {filename: image_hash
+            for filename, image_hash in zip(image_filenames, hashes)
+            if image_hash}
+
+
+def derivatives_served(image_hash):
+    """Whether the derivatives with the given hash can be downloaded.
+
+    With the production static files profile they are served from
+    STATIC_ROOT, which lacks those made since the last collectstatic.
+    """
+    if not isinstance(staticfiles_storage, ManifestFilesMixin):
+        return True
+    # The last one written
+    last = derived_filename(image_hash, SIZES[-1][0], FORMATS[-1][0])
+    return staticfiles_storage.exists('images/dogs/derived/' + last)
+
+
+def image_urls(dog):
+    """Return the derivative URLs of a dog's photo by size and format, or
+    None when there are none to download."""
+    if not dog.image_hash or not derivatives_served(dog.image_hash):
+        return None
+    return {
+        size: {
+            # Already content hashed, so not looked up in the manifest
+            extension: settings.STATIC_URL + 'images/dogs/derived/' +
+            derived_filename(dog.image_hash, size, extension)
+            for extension, options in FORMATS
+        }
+        for size, width in SIZES
+    }
+
+
+def image_url(dog, size='card'):
+    """Return the JPEG URL for the given size, or the original photo if
+    there are no derivatives yet."""
+    urls = image_urls(dog)
+    if urls is None:
+        try:
+            return static('images/dogs/' + dog.image_filename)
+        except ValueError:
+            # Not in the static files manifest, so there is no hashed name
+            return settings.STATIC_URL + 'images/dogs/' + dog.image_filename
+    return urls[size]['jpg']
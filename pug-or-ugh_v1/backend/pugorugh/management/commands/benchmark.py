@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from pugorugh import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database with a synthetic catalog and '
+            'reports query counts, latency and peak memory for every route.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dogs', type=int, default=1000,
+                            help='Dogs in the catalog, e.g. 1000, 100000 '
+                                 'or 1000000.')
+        parser.add_argument('--users', type=int, default=10,
+                            help='Users with swipe histories.')
+        parser.add_argument('--swipes', type=int, default=100,
+                            help='Liked or disliked dogs per user.')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Timed requests per route.')
+        parser.add_argument('--status-index', action='store_true',
+                            help='Serve statuses from the in-process '
+                                 'status index.')
+        parser.add_argument('--output', help='Write the JSON report here '
+                                             'instead of standard output.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            started = time.perf_counter()
+            user = benchmarks.seed(options['dogs'], options['users'],
+                                   options['swipes'])
+            seconds = time.perf_counter() - started
+            self.stderr.write('Seeded {} dogs in {:.1f}s.'.format(
+                options['dogs'], seconds))
+
+            with override_settings(STATUS_INDEX=options['status_index']):
+                report = {
+                    'dogs': options['dogs'],
+                    'users': options['users'],
+                    'swipes': options['swipes'],
+                    'repeat': options['repeat'],
+                    'database': connection.vendor,
+                    'status_index': options['status_index'],
+                    'routes': benchmarks.run(user, options['repeat']),
+                    'page_load': benchmarks.cold_page_load(Client()),
+                    'ranking': benchmarks.ranking_timings(user),
+                    'renderers': benchmarks.render_timings(),
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+from os import path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_framework.exceptions import ValidationError
+
+from pugorugh import dog_cache
+from pugorugh import models
+from pugorugh import serializers
+
+
+PROJ_DIR = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+DEFAULT_PATH = path.join(PROJ_DIR, 'static', 'dog_details.json')
+
+FORMATS = ('json', 'jsonl', 'csv')
+EXTENSIONS = {
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+}
+NATURAL_KEYS = ('image_filename', 'name')
+
+
+def iter_json_array(file, read_size=1 << 16):
+    """Yield the items of a JSON array one at a time without loading the
+    whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and the separators between items
+        while position < len(buffer) and (
+                buffer[position].isspace() or
+                (started and buffer[position] == ',')):
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                yield item
+                continue
+        elif eof:
+            raise ValueError('Unexpected end of JSON array.')
+
+        chunk = file.read(read_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_rows(file, format):
+    if format == 'json':
+        return iter_json_array(file)
+    if format == 'jsonl':
+        return iter_json_lines(file)
+    return csv.DictReader(file)
+
+
+def batched(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Imports dogs from a JSON, JSON lines or CSV file in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='File to import, or - for standard input. '
+                 'Defaults to the sample catalog.')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Input format. Guessed from the file extension by default.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows validated and written per transaction.')
+        parser.add_argument(
+            '--key', choices=NATURAL_KEYS,
+            help='Update dogs that already have the same value for this '
+                 'field instead of adding them again.')
+
+    def handle(self, *args, **options):
+        format = options['format']
+        if format is None:
+            format = EXTENSIONS.get(path.splitext(options['path'])[1].lower())
+            if format is None:
+                raise CommandError('Cannot tell the format of {}, use --format.'
+                                   .format(options['path']))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        if options['path'] == '-':
+            file = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        else:
+            file = open(options['path'], 'r', encoding='utf-8', newline='')
+
+        started = time.perf_counter()
+        totals = {'created': 0, 'updated': 0, 'invalid': 0}
+        with file:
+            rows = iter_rows(file, format)
+            try:
+                for number, batch in enumerate(
+                        batched(rows, options['batch_size'])):
+                    counts = self.import_batch(
+                        batch, options['key'], number * options['batch_size'])
+                    for name, count in counts.items():
+                        totals[name] += count
+            except (ValueError, csv.Error) as error:
+                raise CommandError('Could not read {}: {}'.format(
+                    options['path'], error))
+
+        elapsed = time.perf_counter() - started
+        imported = totals['created'] + totals['updated']
+        self.stdout.write(
+            'Imported {} dogs ({created} created, {updated} updated, '
+            '{invalid} invalid) in {:.2f}s, {:.0f} rows/s.'.format(
+                imported, elapsed, imported / elapsed if elapsed else 0,
+                **totals))
+
+    def import_batch(self, batch, key, offset):
+        serializer = serializers.DogSerializer()
+
+        dogs = []
+        for index, data in enumerate(batch):
+            try:
+                dogs.append(models.Dog(**serializer.run_validation(data)))
+            except ValidationError as error:
+                self.stderr.write('Row {}: {}'.format(offset + index + 1,
+                                                      error.detail))
+        counts = {'created': 0, 'updated': 0,
+                  'invalid': len(batch) - len(dogs)}
+
+        with transaction.atomic():
+            if key:
+                # The last row wins when a key repeats within a batch
+                dogs = list({getattr(dog, key): dog for dog in dogs}.values())
+                existing = dict(
+                    models.Dog.objects
+                    .filter(**{key + '__in': [getattr(dog, key) for dog in dogs]})
+                    .values_list(key, 'id'))
+                updates = [dog for dog in dogs if getattr(dog, key) in existing]
+                dogs = [dog for dog in dogs if getattr(dog, key) not in existing]
+                for dog in updates:
+                    dog.id = existing[getattr(dog, key)]
+                    dog.age_stage = dog.get_age_stage
+                    dog.name_key = models.search_key(dog.name)
+                fields = [name for name, field in serializer.fields.items()
+                          if not field.read_only]
+                models.Dog.objects.bulk_update(
+                    updates, fields + ['age_stage', 'name_key'])
+                # bulk_update skips the save signals
+                dog_cache.invalidate([dog.id for dog in updates])
+                if updates:
+                    models.catalog_changed()
+                counts['updated'] = len(updates)
+
+            models.Dog.objects.bulk_create(dogs)
+            counts['created'] = len(dogs)
+
+        return counts
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pugorugh import dog_cache
+from pugorugh import images
+from pugorugh import models
+
+
+class Command(BaseCommand):
+    help = ('Writes resized JPEG and WebP copies of the dog photos and '
+            'records them on the dogs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Process every photo, not only ones without copies yet.')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Worker processes. Defaults to the number of CPUs.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Photos processed between database writes.')
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError('Pillow must be installed to resize photos.')
+
+        dogs = models.Dog.objects.all()
+        if not options['all']:
+            dogs = dogs.filter(image_hash='')
+        filenames = list(dogs.order_by('image_filename')
+                         .values_list('image_filename', flat=True).distinct())
+
+        started = time.perf_counter()
+        processed = updated = 0
+        batch_size = options['batch_size']
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for start in range(0, len(filenames), batch_size):
+                hashes = images.process_images(
+                    filenames[start:start + batch_size], executor)
+                with transaction.atomic():
+                    dog_ids = models.Dog.objects.set_image_hashes(hashes)
+                dog_cache.invalidate(dog_ids)
+                processed += len(hashes)
+                updated += len(dog_ids)
+
+        self.stdout.write(
+            'Processed {} of {} photos for {} dogs in {:.1f}s.'.format(
+                processed, len(filenames), updated,
+                time.perf_counter() - started))
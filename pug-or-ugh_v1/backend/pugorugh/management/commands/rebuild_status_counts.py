@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from pugorugh import models
+
+
+class Command(BaseCommand):
+    help = ("Recounts every user's liked and disliked dogs from their "
+            "UserDog rows, replacing the running counts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Users read and written per batch.')
+
+    def handle(self, *args, **options):
+        users = models.UserStatusCount.objects.rebuild(options['batch_size'])
+        self.stdout.write('Counted the statuses of {} users.'.format(users))
@@ -0,0 +1,41 @@
+import json
+import tempfile
+from os import path
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from pugorugh import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Runs many simultaneous swipe writers against a throwaway copy '
+            'of the configured database profile and reports errors, '
+            'throughput and latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8,
+                            help='Writer processes, one user each.')
+        parser.add_argument('--swipes', type=int, default=100,
+                            help='Swipes per writer.')
+        parser.add_argument('--dogs', type=int, default=1000,
+                            help='Dogs in the catalog.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # Writer processes cannot share an in-memory database
+                connection.settings_dict['TEST']['NAME'] = path.join(
+                    directory, 'swipes.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0,
+                                                          autoclobber=True)
+            try:
+                report = benchmarks.concurrent_swipes(
+                    options['writers'], options['swipes'], options['dogs'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,143 @@
+"""Per-route request metrics in the Prometheus text format.
+
+``middleware.RequestMetricsMiddleware`` records every request's latency,
+query count, SQL time and render time here under its route name from
+``urls.py``. It also flags requests running one query shape many times,
+the usual sign of an N+1 query. ``/api/stats/metrics/`` serves the
+totals of the current process.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# A query shape run this many times in one request is flagged
+N_PLUS_ONE_THRESHOLD = 5
+
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+
+
+def query_shape(sql):
+    """Return the SQL with lists of placeholders collapsed, so queries
+    differing only in the number of ids look alike."""
+    return PLACEHOLDER_LIST.sub('(%s, ...)', sql)
+
+
+class QueryRecorder:
+    """A database execute wrapper timing and counting one request's
+    queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated_shapes(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return [(shape, count) for shape, count in self.shapes.items()
+                if count >= threshold]
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.requests = Counter()
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.n_plus_one = 0
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = defaultdict(RouteMetrics)
+
+    def record(self, route, method, status, seconds, queries=0,
+               sql_seconds=0.0, render_seconds=0.0, n_plus_one=False):
+        with self.lock:
+            metrics = self.routes[route]
+            metrics.requests[(method, status)] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    metrics.buckets[index] += 1
+            metrics.queries += queries
+            metrics.sql_seconds += sql_seconds
+            metrics.render_seconds += render_seconds
+            metrics.n_plus_one += n_plus_one
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                '# HELP pugorugh_requests_total Requests served.',
+                '# TYPE pugorugh_requests_total counter',
+            ]
+            for route, metrics in routes:
+                for (method, status), count in sorted(metrics.requests.items()):
+                    lines.append(
+                        'pugorugh_requests_total{{route="{}",method="{}",'
+                        'status="{}"}} {}'.format(route, method, status, count))
+
+            lines += [
+                '# HELP pugorugh_request_duration_seconds Request latency.',
+                '# TYPE pugorugh_request_duration_seconds histogram',
+            ]
+            for route, metrics in routes:
+                for bound, count in zip(BUCKETS, metrics.buckets):
+                    lines.append(
+                        'pugorugh_request_duration_seconds_bucket{{route="{}",'
+                        'le="{}"}} {}'.format(route, bound, count))
+                lines += [
+                    'pugorugh_request_duration_seconds_bucket{{route="{}",'
+                    'le="+Inf"}} {}'.format(route, metrics.count),
+                    'pugorugh_request_duration_seconds_sum{{route="{}"}} '
+                    '{:.6f}'.format(route, metrics.seconds),
+                    'pugorugh_request_duration_seconds_count{{route="{}"}} '
+                    '{}'.format(route, metrics.count),
+                ]
+
+            for name, attribute, help_text, template in (
+                    ('pugorugh_request_queries_total', 'queries',
+                     'Database queries run.', '{}'),
+                    ('pugorugh_request_sql_seconds_total', 'sql_seconds',
+                     'Time spent in database queries.', '{:.6f}'),
+                    ('pugorugh_request_render_seconds_total',
+                     'render_seconds', 'Time spent rendering responses.',
+                     '{:.6f}'),
+                    ('pugorugh_n_plus_one_total', 'n_plus_one',
+                     'Requests running one query shape at least {} '
+                     'times.'.format(N_PLUS_ONE_THRESHOLD), '{}')):
+                lines += ['# HELP {} {}'.format(name, help_text),
+                          '# TYPE {} counter'.format(name)]
+                for route, metrics in routes:
+                    lines.append('{}{{route="{}"}} {}'.format(
+                        name, route,
+                        template.format(getattr(metrics, attribute))))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
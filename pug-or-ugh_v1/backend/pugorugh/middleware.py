@@ -0,0 +1,103 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+
+from . import metrics
+from . import routers
+
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RequestMetricsMiddleware:
+    """ Records each request's route, latency, queries, SQL time and
+    render time in ``metrics.registry``.
+
+    Turned off with the ``REQUEST_METRICS`` setting.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'REQUEST_METRICS', True):
+            return self.get_response(request)
+
+        recorder = metrics.QueryRecorder()
+        request._metrics_render_seconds = 0.0
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = (resolver_match.url_name if resolver_match and
+                 resolver_match.url_name else 'unmatched')
+        repeated = recorder.repeated_shapes()
+        for shape, count in repeated:
+            metrics.logger.warning('Possible N+1 query on %s, run %s times: %s',
+                                   route, count, shape)
+        metrics.registry.record(
+            route, request.method, response.status_code, seconds,
+            queries=recorder.count,
+            sql_seconds=recorder.seconds,
+            render_seconds=request._metrics_render_seconds,
+            n_plus_one=bool(repeated),
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the rendering, which happens right after this hook."""
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_seconds += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """ Reads from the primary database throughout requests that write,
+    and afterwards for a while for the user who made them. See
+    ``routers.py``. """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = request.method in UNSAFE_METHODS
+        # Threads serve many requests, so start every one unpinned
+        routers.pin(writes)
+        try:
+            response = self.get_response(request)
+            user = getattr(request, 'user', None)
+            if (writes and response.status_code < 400 and
+                    user is not None and user.is_authenticated):
+                routers.record_write(user.id)
+            return response
+        finally:
+            routers.pin(False)
+
+
+class GZipLargeResponseMiddleware(GZipMiddleware):
+    """ Gzips responses of at least ``GZIP_MIN_BYTES`` bytes, and streamed
+    ones, for clients accepting it. Smaller bodies gain too little to be
+    worth the CPU time.
+
+    Turned off by setting ``GZIP_MIN_BYTES`` to None.
+    """
+    min_bytes = 1024
+
+    def process_response(self, request, response):
+        min_bytes = getattr(settings, 'GZIP_MIN_BYTES', self.min_bytes)
+        if min_bytes is None or (not response.streaming and
+                                 len(response.content) < min_bytes):
+            return response
+        return super(GZipLargeResponseMiddleware, self).process_response(
+            request, response)
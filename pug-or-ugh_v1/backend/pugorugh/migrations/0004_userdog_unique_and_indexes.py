@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:59
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_user_dogs(apps, schema_editor):
+    """Keep only the newest row for each user and dog pair."""
+    UserDog = apps.get_model('pugorugh', 'UserDog')
+    user_dogs = UserDog.objects.using(schema_editor.connection.alias)
+    newest = (user_dogs.values('user', 'dog')
+              .annotate(newest_id=Max('id'))
+              .values_list('newest_id', flat=True))
+    user_dogs.exclude(id__in=list(newest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pugorugh', '0003_auto_20191025_2008'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_user_dogs,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='userdog',
+            unique_together={('user', 'dog')},
+        ),
+        migrations.AddIndex(
+            model_name='userdog',
+            index=models.Index(fields=['user', 'status', 'dog'], name='userdog_user_status_dog_idx'),
+        ),
+    ]
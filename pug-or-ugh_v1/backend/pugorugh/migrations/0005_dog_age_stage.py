@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+# Same boundaries as DOG_AGES in pugorugh.models, in months
+AGE_STAGE_STARTS = (
+    ('y', 7),
+    ('a', 13),
+    ('s', 85),
+)
+
+
+def backfill_age_stage(apps, schema_editor):
+    """Set every dog's age stage with one update per stage."""
+    Dog = apps.get_model('pugorugh', 'Dog')
+    dogs = Dog.objects.using(schema_editor.connection.alias)
+    for stage, start in AGE_STAGE_STARTS:
+        dogs.filter(age__gte=start).update(age_stage=stage)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0004_userdog_unique_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='age_stage',
+            field=models.CharField(choices=[('b', 'Baby'), ('y', 'Young'), ('a', 'Adult'), ('s', 'Senior')], db_index=True, default='b', editable=False, max_length=1),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_age_stage, migrations.RunPython.noop),
+    ]
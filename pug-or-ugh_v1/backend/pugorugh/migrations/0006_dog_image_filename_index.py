@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0005_dog_age_stage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dog',
+            name='image_filename',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0006_dog_image_filename_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
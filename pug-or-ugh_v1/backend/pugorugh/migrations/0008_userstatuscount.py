@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def count_statuses(apps, schema_editor):
+    """Count every user's liked and disliked dogs."""
+    UserDog = apps.get_model('pugorugh', 'UserDog')
+    UserStatusCount = apps.get_model('pugorugh', 'UserStatusCount')
+    alias = schema_editor.connection.alias
+    counts = (UserDog.objects.using(alias).filter(status__isnull=False)
+              .values('user_id')
+              .annotate(liked=Count('id', filter=Q(status='l')),
+                        disliked=Count('id', filter=Q(status='d')))
+              .order_by())
+    UserStatusCount.objects.using(alias).bulk_create(
+        [UserStatusCount(**count) for count in counts], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pugorugh', '0007_dog_image_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStatusCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('liked', models.IntegerField(default=0)),
+                ('disliked', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='status_count', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(count_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+def backfill_name_key(apps, schema_editor):
+    """Set every dog's name key as pugorugh.models.search_key does, a
+    batch at a time."""
+    Dog = apps.get_model('pugorugh', 'Dog')
+    dogs = Dog.objects.using(schema_editor.connection.alias)
+    batch = []
+    for dog in dogs.only('id', 'name').iterator(chunk_size=2000):
+        dog.name_key = ' '.join(dog.name.lower().split())
+        batch.append(dog)
+        if len(batch) == 2000:
+            dogs.bulk_update(batch, ['name_key'])
+            batch = []
+    dogs.bulk_update(batch, ['name_key'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0008_userstatuscount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_name_key, migrations.RunPython.noop),
+    ]
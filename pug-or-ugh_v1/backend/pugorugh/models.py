@@ -1,5 +1,11 @@
-from django.db import models
-from django.db import IntegrityError
+import time
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, models, router, transaction
+from django.db.models import Count, F, Q
 
 from django.contrib.auth.models import User
 
@@ -12,6 +18,325 @@ DOG_AGES = {
     's': range(85, 361),
 }
 
+CATALOG_SIZE_KEY = 'pugorugh:catalog-size'
+# Moves forward on every change to the catalog
+CATALOG_VERSION_KEY = 'pugorugh:catalog-version'
+# The catalog version of the last change other than adding dogs
+CATALOG_CHANGED_KEY = 'pugorugh:catalog-changed'
+# Moves forward on every change to a user's statuses
+STATUS_VERSION_KEY = 'pugorugh:status-version:{}'
+# Moves forward on every change to a user's preferences
+PREF_VERSION_KEY = 'pugorugh:pref-version:{}'
+
+
+def stamp_cache():
+    """The cache of the version stamps, which the dog indexes and ETags
+    are checked against."""
+    return caches[getattr(settings, 'STAMP_CACHE_ALIAS', 'default')]
+
+
+def search_key(text):
+    """Lower case text with single spaces, as names and breeds are
+    searched."""
+    return ' '.join(text.lower().split())
+
+
+class DogQuerySet(models.QuerySet):
+    """ Queries over the dog catalog from a single user's point of view """
+
+    def with_status(self, user, status):
+        """Dogs the user gave the status; None means undecided.
+
+        A dog is undecided unless the user has a liked or disliked row
+        for it, so undecided dogs never need a UserDog row of their own.
+        """
+        if status is None:
+            decided = UserDog.objects.filter(
+                user=user,
+                status__isnull=False
+            ).values('dog_id')
+            return self.exclude(id__in=decided)
+        return self.filter(userdog__user=user, userdog__status=status)
+
+    def matching(self, user_pref):
+        """Dogs matching the user's gender, size and age preferences."""
+        return self.filter(
+            gender__in=user_pref.gender.split(","),
+            size__in=user_pref.size.split(","),
+            age_stage__in=user_pref.age_stages,
+        )
+
+    def set_image_hashes(self, hashes):
+        """Record photo derivative hashes, given as a dict of image filename
+        to hash, and return the ids of the dogs changed.
+
+        This skips the save signals, so callers must invalidate the cached
+        payloads of the returned dogs.
+        """
+        dogs = list(self.filter(image_filename__in=list(hashes))
+                    .only('id', 'image_filename'))
+        for dog in dogs:
+            dog.image_hash = hashes[dog.image_filename]
+        self.bulk_update(dogs, ['image_hash'], batch_size=1000)
+        if dogs:
+            # The photo URLs in the dog lists changed
+            catalog_changed(added=True)
+        return [dog.id for dog in dogs]
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Fill in each dog's age stage and name key, since bulk_create
+        skips save."""
+        objs = list(objs)
+        for dog in objs:
+            dog.age_stage = dog.get_age_stage
+            dog.name_key = search_key(dog.name)
+        created = super(DogQuerySet, self).bulk_create(objs, *args, **kwargs)
+        # Backends that don't return the new ids, like SQLite, write one
+        # transaction at a time, so their dogs commit in id order anyway
+        dog_ids = [dog.id for dog in created]
+        catalog_changed(added=True,
+                        dog_ids=dog_ids if None not in dog_ids else ())
+        return created
+
+    def catalog_size(self):
+        """The number of dogs, cached until one is added or removed."""
+        cache = stamp_cache()
+        size = cache.get(CATALOG_SIZE_KEY)
+        if size is None:
+            size = Dog.objects.count()
+            cache.set(CATALOG_SIZE_KEY, size, None)
+        return size
+
+
+def catalog_versions():
+    """Return the catalog version and the version of its last change other
+    than adding dogs.
+
+    Both start from the clock when they are missing from the cache, so
+    they still move forward after the cache is cleared.
+    """
+    cache = stamp_cache()
+    keys = [CATALOG_VERSION_KEY, CATALOG_CHANGED_KEY]
+    stamps = cache.get_many(keys)
+    if len(stamps) < len(keys):
+        start = int(time.time() * 1000000)
+        cache.add(CATALOG_VERSION_KEY, start, None)
+        cache.add(CATALOG_CHANGED_KEY, start, None)
+        stamps = cache.get_many(keys)
+    return stamps[CATALOG_VERSION_KEY], stamps[CATALOG_CHANGED_KEY]
+
+
+def version_stamp(key):
+    """Return the version stored under key, starting from the clock like
+    the catalog versions."""
+    cache = stamp_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000000), None)
+        version = cache.get(key)
+    return version
+
+
+def advance_stamp(key):
+    """Move the version stored under key on and return it."""
+    cache = stamp_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version_stamp(key)
+        return cache.incr(key)
+
+
+def user_status_version(user_id):
+    return version_stamp(STATUS_VERSION_KEY.format(user_id))
+
+
+def user_statuses_changed(user_id):
+    """Move a user's status version on and return it."""
+    return record_change(advance_stamp, STATUS_VERSION_KEY.format(user_id))
+
+
+def user_pref_version(user_id):
+    return version_stamp(PREF_VERSION_KEY.format(user_id))
+
+
+def user_pref_changed(user_id):
+    """Move a user's preferences version on and return it."""
+    return record_change(advance_stamp, PREF_VERSION_KEY.format(user_id))
+
+
+def record_change(advance, *args):
+    """Call advance now and, inside a transaction, again once it commits.
+
+    Stamps moved before the commit let the transaction's own reads see
+    the change, but another process reading them in between loads the
+    rows without it, and would keep them until the next change.
+    """
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: advance(*args))
+    return advance(*args)
+
+
+def committed_out_of_order(dog_ids):
+    """Whether another dog with an id above the lowest of the given new
+    dogs was committed, and so maybe loaded, before them.
+
+    Ids come from a sequence when rows are inserted, not when they are
+    committed, so a dog can commit after one with a higher id. Indexes
+    only load the ids above the last one they have, and would miss it.
+    """
+    dogs = Dog.objects.using(router.db_for_write(Dog))
+    return dogs.filter(id__gte=min(dog_ids)).count() != len(dog_ids)
+
+
+def advance_catalog(added, dog_ids=()):
+    cache = stamp_cache()
+    # Only checked once committed, outside the transaction
+    if (added and dog_ids and not connection.in_atomic_block and
+            committed_out_of_order(dog_ids)):
+        added = False
+    cache.delete(CATALOG_SIZE_KEY)
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_versions()
+        version = cache.incr(CATALOG_VERSION_KEY)
+    if not added:
+        cache.set(CATALOG_CHANGED_KEY, version, None)
+
+
+def catalog_changed(added=False, dog_ids=()):
+    """Record a change to the catalog; added means dogs were only added,
+    or changed in ways no index holds, like their photos. dog_ids are the
+    ids of the added dogs, which are checked for coming in id order."""
+    record_change(advance_catalog, added, dog_ids)
+
+
+class UserDogQuerySet(models.QuerySet):
+    """ Writes to the user and dog link table """
+
+    UPSERT_SQL = (
+        'INSERT INTO {userdog} (user_id, dog_id, status) '
+        'SELECT %s, id, %s FROM {dog} WHERE id = %s '
+        'ON CONFLICT (user_id, dog_id) DO UPDATE SET status = excluded.status'
+    )
+    BULK_UPSERT_SQL = (
+        'INSERT INTO {userdog} (user_id, dog_id, status) VALUES {values} '
+        'ON CONFLICT (user_id, dog_id) DO UPDATE SET status = excluded.status'
+    )
+    # Adds the change a new status makes to the user's counts, read from
+    # the old status, so it must run before UPSERT_SQL
+    COUNT_UPSERT_SQL = (
+        'INSERT INTO {counts} (user_id, liked, disliked) '
+        'SELECT %s, '
+        '(CASE WHEN %s = \'l\' THEN 1 ELSE 0 END) - (SELECT COUNT(*) '
+        'FROM {userdog} WHERE user_id = %s AND dog_id = %s '
+        'AND status = \'l\'), '
+        '(CASE WHEN %s = \'d\' THEN 1 ELSE 0 END) - (SELECT COUNT(*) '
+        'FROM {userdog} WHERE user_id = %s AND dog_id = %s '
+        'AND status = \'d\') '
+        'FROM {dog} WHERE id = %s '
+        'ON CONFLICT (user_id) DO UPDATE SET '
+        'liked = {counts}.liked + excluded.liked, '
+        'disliked = {counts}.disliked + excluded.disliked'
+    )
+    # Rows per bulk upsert, keeping under SQLite's 999 parameter limit
+    BULK_UPSERT_ROWS = 300
+    # Advisory lock namespace for per-user status writes
+    LOCK_CLASS = 7001
+    # A write that changes nothing once the user has a count row
+    SQLITE_LOCK_SQL = (
+        'INSERT INTO {counts} (user_id, liked, disliked) VALUES (%s, 0, 0) '
+        'ON CONFLICT (user_id) DO NOTHING'
+    )
+
+    def lock_user(self, user):
+        """Make other transactions changing the user's statuses wait for
+        this one, so none of them counts from a stale status. Call it before
+        the transaction reads anything.
+
+        SQLite runs one writer at a time but takes the write lock at a
+        transaction's first write, and a transaction that read before then
+        fails with "database is locked" at once, busy timeout or not, if
+        another writer committed in between. So on SQLite this writes
+        straight away.
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)',
+                               [self.LOCK_CLASS, user.id])
+            elif connection.vendor == 'sqlite':
+                cursor.execute(self.SQLITE_LOCK_SQL.format(
+                    counts=UserStatusCount._meta.db_table), [user.id])
+
+    def set_status(self, user, dog_id, status):
+        """Record the user's status for a dog with an upsert, and update
+        their status counts to match.
+
+        Returns False when there is no dog with the given id.
+        """
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            with transaction.atomic():
+                if not Dog.objects.filter(id=dog_id).exists():
+                    return False
+                old = self.filter(user=user, dog_id=dog_id).first()
+                self.update_or_create(
+                    user=user, dog_id=dog_id, defaults={'status': status})
+                UserStatusCount.objects.add(
+                    user, [old.status] if old else [], [status])
+            return True
+
+        params = {
+            'counts': UserStatusCount._meta.db_table,
+            'userdog': UserDog._meta.db_table,
+            'dog': Dog._meta.db_table,
+        }
+        with transaction.atomic(), connection.cursor() as cursor:
+            # On SQLite the count upsert, a write, comes first anyway
+            if connection.vendor == 'postgresql':
+                self.lock_user(user)
+            cursor.execute(self.COUNT_UPSERT_SQL.format(**params), [
+                user.id,
+                status, user.id, dog_id,
+                status, user.id, dog_id,
+                dog_id,
+            ])
+            cursor.execute(self.UPSERT_SQL.format(**params),
+                           [user.id, status, dog_id])
+            return cursor.rowcount > 0
+
+    def set_statuses(self, user, statuses):
+        """Record many of the user's statuses, given as a dict of dog id to
+        status, with one upsert per BULK_UPSERT_ROWS dogs.
+
+        Every dog must exist. Run this inside a transaction so a failure
+        leaves no partial batch behind.
+        """
+        self.lock_user(user)
+        old_statuses = self.filter(user=user, dog_id__in=list(statuses),
+                                   status__isnull=False
+                                   ).values_list('status', flat=True)
+        UserStatusCount.objects.add(user, old_statuses, statuses.values())
+
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            for dog_id, status in statuses.items():
+                self.update_or_create(
+                    user=user, dog_id=dog_id, defaults={'status': status})
+            return
+
+        rows = list(statuses.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.BULK_UPSERT_ROWS):
+                chunk = rows[start:start + self.BULK_UPSERT_ROWS]
+                sql = self.BULK_UPSERT_SQL.format(
+                    userdog=UserDog._meta.db_table,
+                    values=', '.join(['(%s, %s, %s)'] * len(chunk)),
+                )
+                params = []
+                for dog_id, status in chunk:
+                    params.extend([user.id, dog_id, status])
+                cursor.execute(sql, params)
+
 
 class Dog(models.Model):
     """ This model involves a dog in the app """
@@ -27,15 +352,41 @@ class Dog(models.Model):
         ('xl', 'extra large'),
         ('u', 'unknown'),
     )
+    AGE_CHOICES = (
+        ('b', 'Baby'),
+        ('y', 'Young'),
+        ('a', 'Adult'),
+        ('s', 'Senior'),
+    )
     
     
     
     name = models.CharField(max_length=255)
-    image_filename = models.CharField(max_length=255)
+    # The name as searched, kept in step with name on save
+    name_key = models.CharField(max_length=255, default="", editable=False,
+                                db_index=True)
+    image_filename = models.CharField(max_length=255, db_index=True)
+
+    # Content hash naming the resized copies of the photo, see images.py
+    image_hash = models.CharField(
+        max_length=16,
+        blank=True,
+        default="",
+        editable=False
+    )
     breed = models.CharField(max_length=255, blank=True, default="")
     
     # age is integer for months
     age = models.IntegerField()
+
+    # 'b' for baby, 'y' for young, 'a' for adult, 's' for senior,
+    # kept in step with age on save
+    age_stage = models.CharField(
+        max_length=1,
+        choices=AGE_CHOICES,
+        editable=False,
+        db_index=True
+    )
     
     # 'm' for male, 'f' for female, 'u' for unknown
     gender = models.CharField(
@@ -49,20 +400,23 @@ class Dog(models.Model):
         max_length=255,
         choices=SIZE_CHOICES
     )
+
+    objects = DogQuerySet.as_manager()
     
     @property
     def get_age_stage(self):
-        if self.age < 12:
+        if self.age < DOG_AGES['y'].start:
             return 'b'
-        elif self.age < 36:
+        elif self.age < DOG_AGES['a'].start:
             return 'y'
-        elif self.age < 72:
+        elif self.age < DOG_AGES['s'].start:
             return 'a'
         else:
             return 's'
 
     def save(self, *args, **kwarg):
         self.age_stage = self.get_age_stage
+        self.name_key = search_key(self.name)
         super(Dog, self).save(*args, **kwarg)
     
     def __str__(self):
@@ -86,17 +440,93 @@ class UserDog(models.Model):
         
     )
     
-    def save(self, *args, **kwargs):
-        if self.pk is None:
-            user_dog = UserDog.objects.filter(user=self.user, dog=self.dog)
-            if user_dog.count() != 0:
-                raise IntegrityError(
-                    "UserDog item with same dog field exist on user_dog %r" % user_dog[0].pk)
-        super(UserDog, self).save(*args, **kwargs)
+    objects = UserDogQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('user', 'dog')
+        indexes = [
+            models.Index(fields=['user', 'status', 'dog'],
+                         name='userdog_user_status_dog_idx'),
+        ]
         
     def __str__(self):
         return self.user.username + "" + self.dog.name
-    
+
+
+class UserStatusCountQuerySet(models.QuerySet):
+    """ Keeps the per-user status counts in step with UserDog """
+
+    ADD_SQL = (
+        'INSERT INTO {counts} (user_id, liked, disliked) VALUES (%s, %s, %s) '
+        'ON CONFLICT (user_id) DO UPDATE SET '
+        'liked = {counts}.liked + excluded.liked, '
+        'disliked = {counts}.disliked + excluded.disliked'
+    )
+
+    def add(self, user, old_statuses, new_statuses):
+        """Count the user's dogs going from the old statuses to the new
+        ones, for example ['l'] to ['d'] for a liked dog being disliked."""
+        old = Counter(old_statuses)
+        new = Counter(new_statuses)
+        liked = new['l'] - old['l']
+        disliked = new['d'] - old['d']
+        if not liked and not disliked:
+            return
+
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            changed = self.filter(user=user).update(
+                liked=F('liked') + liked, disliked=F('disliked') + disliked)
+            if not changed:
+                self.create(user=user, liked=liked, disliked=disliked)
+            return
+
+        sql = self.ADD_SQL.format(counts=UserStatusCount._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.id, liked, disliked])
+
+    def dog_removed(self, dog_id):
+        """Stop counting a dog that is about to be deleted"""
+        for status, field in (('l', 'liked'), ('d', 'disliked')):
+            users = UserDog.objects.filter(
+                dog_id=dog_id, status=status).values('user_id')
+            self.filter(user__in=users).update(**{field: F(field) - 1})
+
+    def rebuild(self, batch_size=5000):
+        """Recount every user's statuses from UserDog and return the number
+        of users with any."""
+        counts = (UserDog.objects.filter(status__isnull=False)
+                  .values('user_id')
+                  .annotate(liked=Count('id', filter=Q(status='l')),
+                            disliked=Count('id', filter=Q(status='d')))
+                  .order_by())
+        with transaction.atomic():
+            self.all().delete()
+            rows = (UserStatusCount(**count)
+                    for count in counts.iterator(chunk_size=batch_size))
+            total = 0
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    return total
+                self.bulk_create(batch)
+                total += len(batch)
+
+
+class UserStatusCount(models.Model):
+    """ How many dogs a user liked and disliked, kept up to date on every
+    swipe so the summary never counts UserDog rows """
+
+    user = models.OneToOneField('auth.User', on_delete=models.CASCADE,
+                                related_name='status_count')
+    liked = models.IntegerField(default=0)
+    disliked = models.IntegerField(default=0)
+
+    objects = UserStatusCountQuerySet.as_manager()
+
+    def __str__(self):
+        return '{}: {} liked, {} disliked'.format(
+            self.user_id, self.liked, self.disliked)
+
 class UserPref(models.Model):
     """ This model includes user preferences """
     
@@ -139,6 +569,13 @@ class UserPref(models.Model):
                 ages.extend(age_range)
 
         return ages
+
+    @property
+    def age_stages(self):
+        """Takes an age given and translates it to a list of age stages"""
+
+        return [age_reference for age_reference in DOG_AGES
+                if age_reference in self.age]
     
     def __str__(self):
         return self.user.username
@@ -0,0 +1,127 @@
+import json
+from collections import OrderedDict
+
+from django.http import StreamingHttpResponse
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+
+class DogKeysetPagination(BasePagination):
+    """ Pages through dogs in id order, one page after a given dog id.
+
+    Paging is opt in: a request without ``after`` or ``page_size`` gets
+    the whole list, as before, unless ``always_page`` is set.
+    """
+    always_page = False
+    after_query_param = 'after'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+
+    def get_int_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: ['A whole number is required.']})
+
+    def get_page(self, request):
+        """Return the id to start after and the page size, or None when
+        the request is not paging."""
+        query_params = request.query_params
+        if (not self.always_page and
+                self.after_query_param not in query_params and
+                self.page_size_query_param not in query_params):
+            return None
+
+        self.request = request
+        after = self.get_int_param(request, self.after_query_param, -1)
+        page_size = self.get_int_param(
+            request, self.page_size_query_param, self.page_size)
+        return after, max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page(request)
+        if page is None:
+            return None
+        after, page_size = page
+
+        # Fetch one extra row to find out if there is a next page
+        page = list(queryset.filter(id__gt=after).order_by('id')[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.last_id = page[-1].id if page else None
+        return page
+
+    def paginate_ids(self, fetch_ids, request, view=None):
+        """Like paginate_queryset, for a function giving up to a number of
+        dog ids after a given id."""
+        page = self.get_page(request)
+        if page is None:
+            return None
+        after, page_size = page
+
+        dog_ids = fetch_ids(after, page_size + 1)
+        self.has_next = len(dog_ids) > page_size
+        dog_ids = dog_ids[:page_size]
+        self.last_id = dog_ids[-1] if dog_ids else None
+        return dog_ids
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.after_query_param, self.last_id)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class DogSearchPagination(DogKeysetPagination):
+    """ Always pages, since a search can match most of the catalog. """
+    always_page = True
+    page_size = 20
+
+
+class StreamingListMixin:
+    """ Streams the whole list as a JSON array when ``stream=1`` is given.
+
+    Rows are read with ``.iterator()`` so the full list is never held in
+    memory, which suits export clients.
+    """
+    stream_query_param = 'stream'
+    stream_chunk_size = 2000
+
+    def is_streaming(self, request):
+        return request.query_params.get(self.stream_query_param) in ('1',
+                                                                     'true')
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming(request):
+            return super(StreamingListMixin, self).list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        return StreamingHttpResponse(self.stream_json(queryset),
+                                     content_type='application/json')
+
+    def stream_json(self, queryset):
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+
+        yield '['
+        rows = queryset.iterator(chunk_size=self.stream_chunk_size)
+        for index, instance in enumerate(rows):
+            if index:
+                yield ','
+            yield json.dumps(serializer_class(instance, context=context).data,
+                             cls=JSONEncoder)
+        yield ']'
@@ -0,0 +1,168 @@
+"""Orders a user's undecided dogs by how much they resemble the dogs they
+liked.
+
+Each dog is a row of codes for its breed, size, gender and age stage in a
+NumPy matrix. A user's taste is the share of their liked dogs having each
+value of each feature, and a dog's score is the weighted sum of the
+shares of its values, computed for a whole batch of candidates with one
+array lookup per feature.
+
+Each process has its own matrix and checks the catalog versions in the
+cache before use, like the eligible dog index. Imported dogs are
+appended; any other change to the catalog builds the matrix again on the
+next ranking.
+
+NumPy is needed to rank dogs. Without it ranked requests are served in
+id order.
+"""
+import threading
+
+from django.db import router
+
+from . import models
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FEATURES = ('breed', 'size', 'gender', 'age_stage')
+WEIGHTS = {
+    'breed': 3.0,
+    'size': 1.0,
+    'gender': 0.5,
+    'age_stage': 1.0,
+}
+LOAD_CHUNK_SIZE = 10000
+# The code of dogs with no breed, which says nothing of a user's taste
+NO_BREED = 0
+
+
+def available():
+    return numpy is not None
+
+
+def normalize(feature, value):
+    if feature == 'breed':
+        return ' '.join(value.lower().split())
+    return value
+
+
+class FeatureMatrix:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.reset()
+
+    def reset(self):
+        self.ids = numpy.empty(0, dtype=numpy.int64)
+        self.codes = numpy.empty((0, len(FEATURES)), dtype=numpy.int32)
+        self.size = 0
+        self.vocabularies = {feature: {} for feature in FEATURES}
+        self.vocabularies['breed'][''] = NO_BREED
+        self.last_id = 0
+
+    def code(self, feature, value):
+        vocabulary = self.vocabularies[feature]
+        return vocabulary.setdefault(normalize(feature, value),
+                                     len(vocabulary))
+
+    def add_dogs(self, rows):
+        """Add (id, breed, size, gender, age stage) rows in id order with
+        ids above last_id."""
+        rows = list(rows)
+        if not rows:
+            return
+        ids = numpy.fromiter((row[0] for row in rows), dtype=numpy.int64,
+                             count=len(rows))
+        codes = numpy.array([
+            [self.code(feature, value)
+             for feature, value in zip(FEATURES, row[1:])]
+            for row in rows
+        ], dtype=numpy.int32)
+
+        # Grow by doubling, so importing in batches stays linear
+        end = self.size + len(rows)
+        if end > len(self.ids):
+            capacity = max(end, 2 * len(self.ids))
+            self.ids = numpy.resize(self.ids, capacity)
+            self.codes = numpy.resize(self.codes, (capacity, len(FEATURES)))
+        self.ids[self.size:end] = ids
+        self.codes[self.size:end] = codes
+        self.size = end
+        self.last_id = int(ids[-1])
+
+    def load(self, after):
+        # From the primary, since the catalog version may be ahead of
+        # the replicas
+        rows = (models.Dog.objects.using(router.db_for_write(models.Dog))
+                .filter(id__gt=after).order_by('id')
+                .values_list('id', *FEATURES)
+                .iterator(chunk_size=LOAD_CHUNK_SIZE))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == LOAD_CHUNK_SIZE:
+                self.add_dogs(chunk)
+                chunk = []
+        self.add_dogs(chunk)
+
+    def refresh(self):
+        """Catch up with the catalog: append new dogs, or build everything
+        again after any other change."""
+        version, changed = models.catalog_versions()
+        if version == self.version:
+            return
+        if self.version is None or changed > self.version:
+            self.reset()
+        self.load(self.last_id)
+        self.version = version
+
+    def find(self, dog_ids):
+        """Return the rows of the given dogs and whether each was found."""
+        ids = self.ids[:self.size]
+        dog_ids = numpy.asarray(dog_ids, dtype=numpy.int64)
+        if not self.size:
+            return (numpy.zeros(len(dog_ids), dtype=numpy.intp),
+                    numpy.zeros(len(dog_ids), dtype=bool))
+        rows = numpy.minimum(numpy.searchsorted(ids, dog_ids), self.size - 1)
+        return rows, ids[rows] == dog_ids
+
+    def scores(self, liked_ids, dog_ids):
+        """Score the dogs against the liked dogs, in the given order."""
+        with self.lock:
+            self.refresh()
+            liked_rows, liked_found = self.find(liked_ids)
+            liked = self.codes[liked_rows[liked_found]]
+            rows, found = self.find(dog_ids)
+            candidates = self.codes[rows]
+            sizes = [len(self.vocabularies[feature]) for feature in FEATURES]
+
+        scores = numpy.zeros(len(dog_ids))
+        if not len(liked):
+            return scores
+        for column, (feature, size) in enumerate(zip(FEATURES, sizes)):
+            shares = numpy.bincount(liked[:, column], minlength=size)
+            shares = shares / len(liked)
+            if feature == 'breed':
+                shares[NO_BREED] = 0
+            scores += WEIGHTS[feature] * shares[candidates[:, column]]
+        # Dogs added since the matrix was read have no features yet
+        scores[~found] = 0
+        return scores
+
+
+matrix = FeatureMatrix() if numpy is not None else None
+
+
+def rank(liked_ids, dog_ids, count=None):
+    """Return up to count of the dog ids, best match to the liked dogs
+    first and in id order among equals."""
+    dog_ids = sorted(dog_ids)
+    if numpy is None or not dog_ids:
+        return dog_ids[:count]
+    scores = matrix.scores(list(liked_ids), dog_ids)
+    # A stable sort keeps equal scores in id order
+    order = numpy.argsort(-scores, kind='stable')
+    return [dog_ids[index] for index in order[:count].tolist()]
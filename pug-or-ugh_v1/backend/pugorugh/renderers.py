@@ -0,0 +1,61 @@
+"""Faster renderers for the API, chosen by the Accept header.
+
+``FastJSONRenderer`` renders compact JSON with orjson when it is
+installed, and like DRF's JSONRenderer otherwise or when indented JSON is
+asked for. ``MessagePackRenderer`` answers ``Accept: application/msgpack``
+(or ``?format=msgpack``) with MessagePack, which needs msgpack.
+
+Large bodies are also gzipped for clients accepting it, see
+``middleware.GZipLargeResponseMiddleware``.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Types neither encoder knows, such as dates, decimals and lazy strings,
+# are encoded as DRF's JSON encoder would
+encode_default = JSONEncoder().default
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or
+                self.get_indent(accepted_media_type,
+                                renderer_context or {}) is not None):
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=encode_default,
+                               option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Such as integers too big for orjson
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        # Keep the output a strict JavaScript subset, as JSONRenderer does
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = (ret.replace(b'\xe2\x80\xa8', b'\\u2028')
+                   .replace(b'\xe2\x80\xa9', b'\\u2029'))
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, use_bin_type=True, default=encode_default)
@@ -0,0 +1,90 @@
+"""Sends reads to read replicas and writes to the primary database.
+
+The replica aliases are listed in the ``DATABASE_REPLICAS`` setting, and
+each read goes to one of them at random. A user who changed something in
+the last ``REPLICA_PIN_SECONDS`` seconds reads from the primary, so a
+swipe is never missing from their next request however far the replicas
+lag. Requests that write read from the primary throughout.
+
+The pin lives in the request's thread, set by ``ReplicaPinMiddleware``
+and by ``CachedTokenAuthentication`` once it knows the user. Users' last
+writes are recorded in the ``STAMP_CACHE_ALIAS`` cache, which every
+server process must share, so the user's next request is pinned whichever
+process serves it.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+
+LAST_WRITE_KEY = 'pugorugh:last-write:{}'
+
+state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def is_pinned():
+    return getattr(state, 'pinned', False)
+
+
+def pin(pinned=True):
+    state.pinned = pinned
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block."""
+    pinned = is_pinned()
+    pin()
+    try:
+        yield
+    finally:
+        pin(pinned)
+
+
+def last_write_cache():
+    return caches[getattr(settings, 'STAMP_CACHE_ALIAS', 'default')]
+
+
+def record_write(user_id):
+    """Send the user's reads to the primary for a while."""
+    if replicas():
+        last_write_cache().set(LAST_WRITE_KEY.format(user_id), True,
+                               getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def read_own_writes(user_id):
+    """Pin the current request to the primary if the user wrote
+    recently."""
+    if replicas() and last_write_cache().get(LAST_WRITE_KEY.format(user_id)):
+        pin()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or is_pinned():
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        # Even for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS}.union(replicas())
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
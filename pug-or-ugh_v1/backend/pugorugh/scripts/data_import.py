@@ -1,4 +1,3 @@
-import json
 from os import environ
 from os import path
 import sys
@@ -10,15 +9,9 @@ PROJ_DIR = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
 
 def load_data():
     filepath = path.join(PROJ_DIR, 'pugorugh', 'static', 'dog_details.json')
-    
-    with open(filepath, 'r', encoding='utf-8') as file:
-        data = json.load(file)
 
-        serializer = DogSerializer(data=data, many=True)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            print(serializer.errors)
+    # The import_dogs command streams the file and writes it in batches
+    call_command('import_dogs', filepath, key='image_filename')
 
     print('load_data done.')
 
@@ -28,13 +21,7 @@ if __name__ == '__main__':
     environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
     django.setup()
 
-    # Assuming your serializer is named DogSerializer
     # has to be imported after django.setup()
-    try:
+    from django.core.management import call_command
 
-        from pugorugh.serializers import DogSerializer
-    except ImportError:
-        raise ImportError('serializers.py must contain a properly '
-            'implemented DogSerializer class for this import to work.')
-
-    load_data()
\ No newline at end of file
+    load_data()
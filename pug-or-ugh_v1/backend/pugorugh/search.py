@@ -0,0 +1,183 @@
+"""Breed and name search over the dog catalog.
+
+Breeds are few next to dogs, so each process keeps every breed's dog
+ids as sorted arrays, one per gender, size and age stage cell, like the
+eligible dog index. A query is matched against the start of every word
+of the breed names through a sorted list, or against words that look
+alike when fuzzy. The arrays of the matching breeds and cells are then
+merged lazily, so a page of results costs about the same at any catalog
+size.
+
+Names are too many to hold in every process. They are searched in the
+database through the indexed ``Dog.name_key`` column instead.
+
+The index checks the catalog versions in the cache before use. New dogs
+are added in place; any other change to the catalog builds it again on
+the next search.
+"""
+import difflib
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+
+from django.db import router
+
+from . import models
+
+
+LOAD_CHUNK_SIZE = 10000
+# How alike a fuzzy query and the start of a breed word must be
+FUZZY_CUTOFF = 0.75
+
+
+def breed_suffixes(breed):
+    """The breed from each of its words on: "golden retriever" gives
+    itself and "retriever"."""
+    words = breed.split()
+    return [' '.join(words[start:]) for start in range(len(words))]
+
+
+def tail(ids, start):
+    for index in range(start, len(ids)):
+        yield ids[index]
+
+
+def next_prefix(prefix):
+    """The first string after every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class BreedIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.reset()
+
+    def reset(self):
+        # Breed to cell to sorted ids
+        self.breeds = {}
+        # Breed to the spellings it was stored with
+        self.spellings = {}
+        # Sorted (suffix, breed) pairs for prefix matching
+        self.suffixes = []
+        self.last_id = 0
+
+    def add_dogs(self, rows):
+        """Add (id, breed, gender, size, age stage) rows with ids above
+        last_id."""
+        for dog_id, breed, gender, size, age_stage in rows:
+            key = models.search_key(breed)
+            if not key:
+                continue
+            cells = self.breeds.get(key)
+            if cells is None:
+                cells = self.breeds[key] = {}
+                self.spellings[key] = set()
+                for suffix in breed_suffixes(key):
+                    insort(self.suffixes, (suffix, key))
+            self.spellings[key].add(breed)
+            ids = cells.setdefault((gender, size, age_stage), array('i'))
+            if not ids or ids[-1] < dog_id:
+                ids.append(dog_id)
+            else:
+                insort(ids, dog_id)
+            self.last_id = max(self.last_id, dog_id)
+
+    def load(self, after):
+        # From the primary, since the catalog version may be ahead of
+        # the replicas
+        rows = (models.Dog.objects.using(router.db_for_write(models.Dog))
+                .filter(id__gt=after).order_by('id')
+                .values_list('id', 'breed', 'gender', 'size', 'age_stage')
+                .iterator(chunk_size=LOAD_CHUNK_SIZE))
+        self.add_dogs(rows)
+
+    def refresh(self):
+        """Catch up with the catalog: load new dogs, or everything again
+        after any other change."""
+        version, changed = models.catalog_versions()
+        if version == self.version:
+            return
+        if self.version is None or changed > self.version:
+            self.reset()
+        self.load(self.last_id)
+        self.version = version
+
+    def match(self, query, fuzzy=False):
+        """Return the breeds with a word starting with the query, or with
+        one starting much like it when fuzzy."""
+        start = bisect_left(self.suffixes, (query,))
+        end = bisect_left(self.suffixes, (next_prefix(query),))
+        breeds = {breed for suffix, breed in self.suffixes[start:end]}
+        if fuzzy:
+            matcher = difflib.SequenceMatcher(b=query)
+            for suffix, breed in self.suffixes:
+                matcher.set_seq1(suffix[:len(query)])
+                if (matcher.real_quick_ratio() >= FUZZY_CUTOFF and
+                        matcher.quick_ratio() >= FUZZY_CUTOFF and
+                        matcher.ratio() >= FUZZY_CUTOFF):
+                    breeds.add(breed)
+        return breeds
+
+    def matching_breeds(self, query, fuzzy=False):
+        """Return the breeds matching the query and their spellings"""
+        with self.lock:
+            self.refresh()
+            breeds = self.match(query, fuzzy)
+            return breeds, {spelling for breed in breeds
+                            for spelling in self.spellings[breed]}
+
+    def ids_after(self, breeds, filters, after, count):
+        """Return up to count ids of dogs of the breeds in the cells
+        allowed by filters, in id order, after the given id."""
+        genders, sizes, age_stages = filters
+        with self.lock:
+            streams = []
+            for breed in breeds:
+                for (gender, size, age_stage), ids in self.breeds.get(
+                        breed, {}).items():
+                    if ((genders is None or gender in genders) and
+                            (sizes is None or size in sizes) and
+                            (age_stages is None or age_stage in age_stages)):
+                        streams.append(tail(ids, bisect_right(ids, after)))
+            return list(islice(heapq.merge(*streams), count))
+
+
+index = BreedIndex()
+
+
+def search(breed=None, name=None, fuzzy=False, genders=None, sizes=None,
+           age_stages=None):
+    """Return a function giving up to a number of matching dog ids after a
+    given id, for ``DogKeysetPagination.paginate_ids``.
+
+    The queries must not be blank once normalized, and the filters are
+    collections of codes, or None for any.
+    """
+    filters = (genders, sizes, age_stages)
+    breeds = spellings = None
+    if breed is not None:
+        breeds, spellings = index.matching_breeds(models.search_key(breed),
+                                                  fuzzy)
+
+    if name is None:
+        return lambda after, count: index.ids_after(breeds, filters, after,
+                                                    count)
+
+    name = models.search_key(name)
+    # The range lets the database read the name_key index, and
+    # startswith keeps collations ordering by more than code points
+    # honest
+    queryset = models.Dog.objects.filter(
+        name_key__gte=name, name_key__lt=next_prefix(name),
+        name_key__startswith=name)
+    for field, values in (('breed', spellings), ('gender', genders),
+                          ('size', sizes), ('age_stage', age_stages)):
+        if values is not None:
+            queryset = queryset.filter(**{field + '__in': list(values)})
+
+    return lambda after, count: list(
+        queryset.filter(id__gt=after).order_by('id')
+        .values_list('id', flat=True)[:count])
@@ -2,6 +2,7 @@ from django.contrib.auth import get_user_model
 
 from rest_framework import serializers
 
+from . import images as dog_images
 from . import models
 
 class UserSerializer(serializers.ModelSerializer):
@@ -21,15 +22,25 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class DogSerializer(serializers.ModelSerializer):
-    
-    
-        
+    image_url = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+
+    def get_image_url(self, dog):
+        """A card sized photo, or the original until it is resized"""
+        return dog_images.image_url(dog)
+
+    def get_images(self, dog):
+        return dog_images.image_urls(dog)
+
+    def validate_image_filename(self, value):
+        if dog_images.source_path(value) is None:
+            raise serializers.ValidationError(
+                'Must be a photo in the dog images folder.')
+        return value
     
     class Meta:
         model = models.Dog
-        fields = (
-            '__all__'
-        )
+        exclude = ('name_key',)
         
         
 class UserDogSerializer(serializers.ModelSerializer):
@@ -46,6 +57,48 @@ class UserDogSerializer(serializers.ModelSerializer):
         )
         extra_kwargs = {'user': {'write_only': True}}
         
+class StatusDecisionSerializer(serializers.Serializer):
+    """ One like, dislike or undecide in a batch of swipes """
+    dog = serializers.IntegerField()
+    status = serializers.ChoiceField(
+        choices=('liked', 'disliked', 'undecided'))
+
+
+class CodeListField(serializers.CharField):
+    """ A comma separated list of choice codes, such as "s,m" for sizes """
+
+    def __init__(self, choices, **kwargs):
+        self.codes = [code for code, name in choices]
+        super(CodeListField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        codes = set(super(CodeListField, self).to_internal_value(data)
+                    .split(','))
+        unknown = codes.difference(self.codes)
+        if unknown:
+            raise serializers.ValidationError('Must be some of {}.'.format(
+                ', '.join(self.codes)))
+        return codes
+
+
+class DogSearchSerializer(serializers.Serializer):
+    """ The query string of a dog search """
+    breed = serializers.CharField(required=False, max_length=255)
+    name = serializers.CharField(required=False, max_length=255)
+    fuzzy = serializers.BooleanField(required=False, default=False)
+    gender = CodeListField(models.Dog.GENDER_CHOICES, required=False,
+                           source='genders')
+    size = CodeListField(models.Dog.SIZE_CHOICES, required=False,
+                         source='sizes')
+    age = CodeListField(models.Dog.AGE_CHOICES, required=False,
+                        source='age_stages')
+
+    def validate(self, data):
+        if 'breed' not in data and 'name' not in data:
+            raise serializers.ValidationError('Give a breed, a name or both.')
+        return data
+
+
 class UserPrefSerializer(serializers.ModelSerializer):
     
     class Meta:
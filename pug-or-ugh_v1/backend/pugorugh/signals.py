@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from . import authentication
+from . import dog_cache
+from . import images
+from . import models
+
+
+# Resizes the photos of new dogs off the request thread
+image_executor = ThreadPoolExecutor(max_workers=1)
+
+
+@receiver(post_save, sender=models.Dog)
+@receiver(post_delete, sender=models.Dog)
+def invalidate_dog_payload(sender, instance, **kwargs):
+    """Drop the cached payload of a dog that changed or went away"""
+    dog_cache.invalidate([instance.id])
+
+
+@receiver(post_save, sender=models.Dog)
+@receiver(post_delete, sender=models.Dog)
+def record_catalog_change(sender, instance, **kwargs):
+    """Move the catalog version on, so its size and the eligible dog
+    index are worked out again"""
+    created = kwargs.get('created', False)
+    models.catalog_changed(added=created,
+                           dog_ids=(instance.id,) if created else ())
+
+
+@receiver(post_save, sender=models.UserDog)
+def record_status_change(sender, instance, **kwargs):
+    """Move the user's status version on for statuses saved outside the
+    status views"""
+    models.user_statuses_changed(instance.user_id)
+
+
+@receiver(post_save, sender=models.UserPref)
+@receiver(post_delete, sender=models.UserPref)
+def record_pref_change(sender, instance, **kwargs):
+    """Move the user's preferences version on, so clients holding the old
+    preferences download them again"""
+    models.user_pref_changed(instance.user_id)
+
+
+@receiver(pre_delete, sender=models.Dog)
+def uncount_dog_statuses(sender, instance, **kwargs):
+    """Take a dog out of its users' status counts before its UserDog rows
+    are deleted with it"""
+    models.UserStatusCount.objects.dog_removed(instance.id)
+
+
+def process_dog_image(dog_id, image_filename):
+    try:
+        image_hash = images.process_image(image_filename)
+        if image_hash:
+            models.Dog.objects.filter(id=dog_id).set_image_hashes(
+                {image_filename: image_hash})
+            dog_cache.invalidate([dog_id])
+    finally:
+        connections.close_all()
+
+
+@receiver(post_save, sender=models.Dog)
+def resize_new_dog_image(sender, instance, created, **kwargs):
+    """Make the photo derivatives of a new dog once it is committed"""
+    if (not created or instance.image_hash or images.Image is None or
+            not getattr(settings, 'PROCESS_DOG_IMAGES_ON_CREATE', True)):
+        return
+    transaction.on_commit(lambda: image_executor.submit(
+        process_dog_image, instance.id, instance.image_filename))
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    """Stop accepting a cached token once it is deleted"""
+    authentication.evict_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def evict_saved_user(sender, instance, **kwargs):
+    """Reload a user's cached token after any change, such as being
+    deactivated"""
+    authentication.evict_user(instance.id)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Let SQLite readers and a writer work at the same time"""
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_WAL',
+                                                    False):
+        return
+    if connection.settings_dict['NAME'] in getattr(
+            settings, 'SQLITE_WAL_EXCLUDED_PATHS', ()):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """Drop persistent connections that went away since the last request,
+    so the request opens a fresh one instead of failing"""
+    if not getattr(settings, 'DB_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
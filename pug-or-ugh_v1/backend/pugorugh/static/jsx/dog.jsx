@@ -13,11 +13,12 @@ var Dog = React.createClass({
   },
   getNext: function () {
     this.serverRequest = $.ajax({
-      url: `api/dog/${ this.state.details ? this.state.details.id : -1 }/${ this.state.filter }/next/`,
+      url: `api/dog/${ this.state.details ? this.state.details.id : -1 }/${ this.state.filter }/next/?prefetch=3`,
       method: "GET",
       dataType: "json",
       headers: TokenAuth.getAuthHeader()
     }).done(function(data) {
+      this.preloadImages(data.upcoming);
       this.setState({details: data, message: undefined});
     }.bind(this))
       .fail(function (response) {
@@ -34,6 +35,12 @@ var Dog = React.createClass({
         this.setState({ message: message, details: undefined});
     }.bind(this));
   },
+  preloadImages: function(upcoming) {
+    // Fetch the next few photos while this dog is on screen
+    (upcoming || []).forEach(function(dog) {
+      new Image().src = dog.images ? dog.images.card.webp : dog.image_url;
+    });
+  },
   changeDogStatus: function (newStatus) {
     this.serverRequest = $.ajax({
       url: `api/dog/${ this.state.details.id }/${ newStatus }/`,
@@ -53,6 +60,18 @@ var Dog = React.createClass({
   handlePreferencesClick: function(event) {
     this.props.setView("preferences");
   },
+  dogImage: function() {
+    var details = this.state.details;
+    if (!details.images) {
+      return <img src={details.image_url} />;
+    }
+    return (
+      <picture>
+        <source type="image/webp" srcSet={details.images.card.webp} />
+        <img src={details.image_url} />
+      </picture>
+    );
+  },
   genderLookup: {m: 'Male', f: 'Female'},
   sizeLookup: {s: 'Small', m: 'Medium', l: 'Large', xl: 'Extra Large'},
   dogControls: function() {
@@ -118,7 +137,7 @@ var Dog = React.createClass({
 
     return (
       <div>
-        <img src={"static/images/dogs/" + this.state.details.image_filename} />
+        {this.dogImage()}
         <p className="dog-card">
           {this.state.details.name}&bull;
           {this.state.details.breed}&bull;
@@ -0,0 +1,241 @@
+"""An in-process index of users' liked and disliked dog ids.
+
+Each user's statuses are held as two compressed bitmaps, loaded from
+``UserDog`` in one query the first time they are needed and kept up to
+date by the status views. The next dog and status list views then page
+through a user's dogs without joining ``Dog`` to ``UserDog``.
+
+The index is optional, turned on with the ``STATUS_INDEX`` setting, and
+holds at most ``STATUS_INDEX_USERS`` users per process. Every status
+write moves the user's status version in the cache, so a process whose
+copy is behind, because the write went through another process, loads
+it again. Deleting or changing dogs empties the index.
+"""
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import router
+
+from . import models
+
+
+MAX_USERS = 1000
+# Ids of undecided dogs are read from the catalog this many at a time
+UNDECIDED_WINDOW = 500
+
+
+class Bitmap:
+    """A set of non-negative ids in containers of 65536 ids each.
+
+    A container is a sorted array of the low 16 bits of its ids while it
+    holds up to ``ARRAY_MAX`` of them, and a 8 KiB bitmap after that, so
+    sparse and dense id ranges both stay small.
+    """
+    ARRAY_MAX = 4096
+    BITMAP_BYTES = 1 << 13
+
+    def __init__(self, ids=()):
+        self.keys = array('i')
+        self.containers = {}
+        self.size = 0
+        for dog_id in ids:
+            self.add(dog_id)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, dog_id):
+        container = self.containers.get(dog_id >> 16)
+        if container is None:
+            return False
+        low = dog_id & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __iter__(self):
+        return self.iter_after(-1)
+
+    def add(self, dog_id):
+        high, low = dog_id >> 16, dog_id & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            insort(self.keys, high)
+            container = self.containers[high] = array('H')
+
+        if isinstance(container, bytearray):
+            mask = 1 << (low & 7)
+            if not container[low >> 3] & mask:
+                container[low >> 3] |= mask
+                self.size += 1
+            return
+
+        if container and container[-1] < low:
+            container.append(low)
+        else:
+            index = bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                return
+            container.insert(index, low)
+        self.size += 1
+        if len(container) > self.ARRAY_MAX:
+            bitmap = bytearray(self.BITMAP_BYTES)
+            for value in container:
+                bitmap[value >> 3] |= 1 << (value & 7)
+            self.containers[high] = bitmap
+
+    def discard(self, dog_id):
+        high, low = dog_id >> 16, dog_id & 0xFFFF
+        container = self.containers.get(high)
+        if container is None or dog_id not in self:
+            return
+        if isinstance(container, bytearray):
+            container[low >> 3] &= ~(1 << (low & 7))
+        else:
+            container.remove(low)
+        self.size -= 1
+
+    def iter_after(self, after):
+        """Yield the ids greater than after in order."""
+        for key in self.keys[bisect_left(self.keys, max(after, 0) >> 16):]:
+            base = key << 16
+            start = after - base + 1 if after >= base else 0
+            if start > 0xFFFF:
+                continue
+            # Containers are copied so a swipe can change them meanwhile
+            container = self.containers[key]
+            if isinstance(container, bytearray):
+                first = start >> 3
+                for byte_index, byte in enumerate(container[first:], first):
+                    while byte:
+                        bit = byte & -byte
+                        low = (byte_index << 3) + bit.bit_length() - 1
+                        if low >= start:
+                            yield base + low
+                        byte ^= bit
+            else:
+                for low in container[bisect_left(container, start):]:
+                    yield base + low
+
+
+class UserStatuses:
+    """One user's liked and disliked dogs"""
+
+    def __init__(self, version):
+        self.version = version
+        self.bitmaps = {'l': Bitmap(), 'd': Bitmap()}
+
+    def __contains__(self, dog_id):
+        return any(dog_id in bitmap for bitmap in self.bitmaps.values())
+
+    def set(self, dog_id, status):
+        for code, bitmap in self.bitmaps.items():
+            if code == status:
+                bitmap.add(dog_id)
+            else:
+                bitmap.discard(dog_id)
+
+    def ids_after(self, status, after, count=None):
+        """Return up to count ids of dogs with the status after the given
+        id; None means undecided."""
+        if status is not None:
+            dog_ids = []
+            for dog_id in self.bitmaps[status].iter_after(after):
+                if count is not None and len(dog_ids) >= count:
+                    break
+                dog_ids.append(dog_id)
+            return dog_ids
+
+        # Undecided dogs are every other dog in the catalog, read by id
+        dog_ids = []
+        while count is None or len(dog_ids) < count:
+            window = list(models.Dog.objects.filter(id__gt=after)
+                          .order_by('id')
+                          .values_list('id', flat=True)[:UNDECIDED_WINDOW])
+            dog_ids.extend(dog_id for dog_id in window if dog_id not in self)
+            if len(window) < UNDECIDED_WINDOW:
+                break
+            after = window[-1]
+        return dog_ids if count is None else dog_ids[:count]
+
+
+class StatusIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        self.catalog_changed = None
+
+    def load(self, user_id, version):
+        statuses = UserStatuses(version)
+        # From the primary, since the status version may be ahead of
+        # the replicas
+        rows = (models.UserDog.objects
+                .using(router.db_for_write(models.UserDog))
+                .filter(user_id=user_id, status__in=('l', 'd'))
+                .order_by('dog_id')
+                .values_list('dog_id', 'status')
+                .iterator(chunk_size=10000))
+        for dog_id, status in rows:
+            statuses.bitmaps[status].add(dog_id)
+        return statuses
+
+    def get(self, user):
+        """Return the user's statuses, loading them if this process has no
+        up to date copy."""
+        version = models.user_status_version(user.id)
+        changed = models.catalog_versions()[1]
+        with self.lock:
+            if changed != self.catalog_changed:
+                self.users.clear()
+                self.catalog_changed = changed
+            statuses = self.users.get(user.id)
+            if statuses is not None and statuses.version == version:
+                self.users.move_to_end(user.id)
+                return statuses
+
+        statuses = self.load(user.id, version)
+        with self.lock:
+            self.users[user.id] = statuses
+            if len(self.users) > getattr(settings, 'STATUS_INDEX_USERS',
+                                         MAX_USERS):
+                self.users.popitem(last=False)
+        return statuses
+
+    def statuses_changed(self, user_id, version, statuses):
+        """Apply new statuses, a dict of dog id to status, to a copy that
+        was up to date before them, or drop a copy that was not."""
+        with self.lock:
+            current = self.users.get(user_id)
+            if current is None:
+                return
+            if current.version != version - 1:
+                del self.users[user_id]
+                return
+            for dog_id, status in statuses.items():
+                current.set(dog_id, status)
+            current.version = version
+
+
+index = StatusIndex()
+
+
+def enabled():
+    return getattr(settings, 'STATUS_INDEX', False)
+
+
+def get(user):
+    """Return the user's statuses, or None when the index is off."""
+    if not enabled():
+        return None
+    return index.get(user)
+
+
+def statuses_changed(user, statuses):
+    """Record new statuses, a dict of dog id to status, for the user."""
+    version = models.user_statuses_changed(user.id)
+    if enabled():
+        index.statuses_changed(user.id, version, statuses)
@@ -1,22 +1,80 @@
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import itertools
 import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
 
 from os import path
-from django.urls import reverse
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.urls import get_resolver, reverse
 from django.contrib.auth.models import User
+from django.test import (Client, RequestFactory, SimpleTestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import (APITestCase,
                                  APIRequestFactory, force_authenticate)
 
+from . import admin as pug_admin
+from . import apps
+from . import benchmarks
+from . import candidates
+from . import middleware
+from . import dog_cache
+from . import eligible
+from . import images
+from . import metrics
 from . import models
+from . import ranking
+from . import renderers
 from . import serializers
+from . import signals
+from . import status_index
 from . import views
 
 
 # Create your tests here.
 
 
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def setUpModule():
+    # Photo derivatives made by any test go to a throwaway folder
+    global derived_dir_patch
+    derived_dir_patch = mock.patch.object(
+        images, 'DERIVED_DIR', tempfile.mkdtemp(prefix='pugorugh-derived-'))
+    derived_dir_patch.start()
+
+
+def tearDownModule():
+    shutil.rmtree(images.DERIVED_DIR, ignore_errors=True)
+    derived_dir_patch.stop()
+
+
 class PugOrUghUserTests(APITestCase):
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
+        # Imported once for the class instead of once per test
         PROJ_DIR = path.dirname(path.dirname(path.abspath(__file__)))
         filepath = path.join(PROJ_DIR, 'pugorugh', 'static',
                              'dog_details.json')
@@ -25,6 +83,9 @@ class PugOrUghUserTests(APITestCase):
             serializer = serializers.DogSerializer(data=data, many=True)
             if serializer.is_valid():
                 serializer.save()
+
+    def setUp(self):
+        clear_caches()
         self.factory = APIRequestFactory()        
         self.user = models.User.objects.create_superuser(
             'testAdmin', 'ad@min.com', 'adminpassword')
@@ -85,6 +146,7 @@ class PugOrUghUserTests(APITestCase):
         
 class PugOrUghDogTests(APITestCase):
     def setUp(self):
+        clear_caches()
         self.factory = APIRequestFactory()
 
         self.user = models.User.objects.create(username='test', password='test')
@@ -187,8 +249,2108 @@ class PugOrUghDogTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
-        
 
 
-    
+class PugOrUghUndecidedTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+
+    def add_dogs(self, count):
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number),
+                       image_filename='1.jpg',
+                       breed='Labrador',
+                       age=24,
+                       gender='m',
+                       size='l')
+            for number in range(count)
+        ])
+
+    def get_next(self, pk, status):
+        request = self.factory.get(reverse('NextDog', kwargs={'status': status,
+                                                              'pk': pk}))
+        force_authenticate(request, user=self.user)
+
+        view = views.NextDogView.as_view()
+        return view(request, pk=pk, status=status)
+
+    def test_undecided_dogs_need_no_user_dog_rows(self):
+        """ Test that a new user sees undecided dogs without any seeding. """
+
+        self.add_dogs(3)
+        first = models.Dog.objects.order_by('id').first()
+
+        response = self.get_next(-1, 'undecided')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], first.id)
+        self.assertEqual(models.UserDog.objects.count(), 0)
+
+    def test_decided_dogs_are_not_undecided(self):
+        """ Test that liked dogs are skipped by the undecided filter. """
+
+        self.add_dogs(2)
+        first, second = models.Dog.objects.order_by('id')
+        models.UserDog.objects.create(user=self.user, dog=first, status='l')
+
+        response = self.get_next(-1, 'undecided')
+
+        self.assertEqual(response.data['id'], second.id)
+
+    def test_no_next_dog_is_not_found(self):
+        """ Test that running out of dogs gives a 404. """
+
+        response = self.get_next(-1, 'liked')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(models.UserDog.objects.count(), 0)
+
+    def test_next_undecided_query_count_is_constant(self):
+        """ Test that the query count does not grow with the catalog. """
+
+        query_counts = []
+        for count in (10, 1000):
+            self.add_dogs(count)
+            clear_caches()
+            with CaptureQueriesContext(connection) as context:
+                response = self.get_next(-1, 'undecided')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(context))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class PugOrUghUpdateStatusTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        self.dog = models.Dog.objects.create(
+            name='Muffin',
+            image_filename='3.jpg',
+            breed='Boxer',
+            age=24,
+            gender='f',
+            size='xl'
+        )
+
+    def put_status(self, pk, status):
+        request = self.factory.put(reverse('UpdateStatus', kwargs={'status': status,
+                                                                   'pk': pk}))
+        force_authenticate(request, user=self.user)
+
+        view = views.UpdateStatus.as_view()
+        return view(request, pk=pk, status=status)
+
+    def put_status_statements(self, pk, status):
+        """ Put a status and return the response and the statements run,
+        leaving out savepoints. """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.put_status(pk, status)
+        return response, [query['sql'] for query in context
+                          if 'SAVEPOINT' not in query['sql']]
+
+    def test_status_change_is_two_upserts(self):
+        """ Test that liking and then disliking a dog are two statements
+        each: one upsert of the status and one of the user's counts. """
+
+        response, statements = self.put_status_statements(self.dog.id,
+                                                          'liked')
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'dog': self.dog.id, 'status': 'l'})
+
+        response, statements = self.put_status_statements(self.dog.id,
+                                                          'disliked')
+        self.assertEqual(len(statements), 2)
+
+        user_dog = models.UserDog.objects.get()
+        self.assertEqual(user_dog.status, 'd')
+
+    def test_undecided_clears_status(self):
+        """ Test that marking a dog undecided clears its status. """
+
+        self.put_status(self.dog.id, 'liked')
+        self.put_status(self.dog.id, 'undecided')
+
+        self.assertIsNone(models.UserDog.objects.get().status)
+
+    def test_missing_dog_is_rejected(self):
+        """ Test that a status for a missing dog gives a 400. """
+
+        response = self.put_status(self.dog.id + 1, 'liked')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(models.UserDog.objects.count(), 0)
+
+    def test_unknown_status_is_rejected(self):
+        """ Test that a status other than liked, disliked or undecided
+        gives a 400. """
+
+        response = self.put_status(self.dog.id, 'loved')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_dog_is_unique(self):
+        """ Test that the database rejects a second row for a user and dog. """
+
+        models.UserDog.objects.create(user=self.user, dog=self.dog, status='l')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.UserDog.objects.create(user=self.user, dog=self.dog,
+                                          status='d')
+
+
+class PugOrUghAgeStageTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+
+    def make_dog(self, age):
+        return models.Dog(name='Muffin', image_filename='3.jpg',
+                          breed='Boxer', age=age, gender='f', size='m')
+
+    def test_age_stage_matches_dog_ages(self):
+        """ Test that the stored age stage follows the DOG_AGES ranges. """
+
+        for stage, ages in models.DOG_AGES.items():
+            for age in (ages.start, ages.stop - 1):
+                dog = self.make_dog(age)
+                dog.save()
+                self.assertEqual(
+                    models.Dog.objects.get(pk=dog.pk).age_stage, stage)
+
+    def test_bulk_create_sets_age_stage(self):
+        """ Test that bulk created dogs get an age stage. """
+
+        models.Dog.objects.bulk_create(
+            [self.make_dog(3), self.make_dog(100)])
+
+        self.assertEqual(
+            list(models.Dog.objects.order_by('age')
+                 .values_list('age_stage', flat=True)),
+            ['b', 's'])
+
+    def test_next_dog_filters_on_age_stage(self):
+        """ Test that undecided dogs are filtered by preferred age stage. """
+
+        models.Dog.objects.bulk_create(
+            [self.make_dog(3), self.make_dog(100)])
+        models.UserPref.objects.create(user=self.user, gender='f',
+                                       age='s', size='m')
+
+        request = self.factory.get(reverse('NextDog', kwargs={'status': 'undecided',
+                                                              'pk': -1}))
+        force_authenticate(request, user=self.user)
+
+        view = views.NextDogView.as_view()
+        response = view(request, pk=-1, status='undecided')
+
+        self.assertEqual(response.data['age'], 100)
+        self.assertEqual(response.data['age_stage'], 's')
+
+
+class PugOrUghListPagingTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(5)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def get_list(self, data):
+        request = self.factory.get(reverse('ListDogs'), data)
+        force_authenticate(request, user=self.user)
+
+        view = views.ListDogsView.as_view()
+        return view(request)
+
+    def test_unpaged_list_is_unchanged(self):
+        """ Test that a plain list request still returns every dog. """
+
+        response = self.get_list({})
+
+        self.assertEqual(len(response.data), 5)
+
+    def test_keyset_pages(self):
+        """ Test walking the list two dogs at a time by dog id. """
+
+        response = self.get_list({'page_size': 2})
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         self.dog_ids[:2])
+        self.assertIn('after={}'.format(self.dog_ids[1]),
+                      response.data['next'])
+
+        response = self.get_list({'page_size': 2, 'after': self.dog_ids[3]})
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         self.dog_ids[4:])
+        self.assertIsNone(response.data['next'])
+
+    def test_bad_after_is_rejected(self):
+        """ Test that a non numeric cursor gives a 400. """
+
+        response = self.get_list({'after': 'abc'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_streamed_list(self):
+        """ Test that a streamed list is the same JSON as the plain list. """
+
+        response = self.get_list({'stream': 1})
+        data = json.loads(b''.join(response.streaming_content).decode())
+
+        serializer = serializers.DogSerializer(
+            models.Dog.objects.order_by('id'), many=True)
+        self.assertEqual(data, serializer.data)
+
+    def test_status_list_pages(self):
+        """ Test that the status list pages through the user's dogs. """
+
+        for dog_id in self.dog_ids[:3]:
+            models.UserDog.objects.create(user=self.user, dog_id=dog_id,
+                                          status='l')
+
+        request = self.factory.get(
+            reverse('ListDogsStatus', kwargs={'status': 'liked'}),
+            {'page_size': 2})
+        force_authenticate(request, user=self.user)
+
+        view = views.ListDogsStatusView.as_view()
+        response = view(request, status='liked')
+
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         self.dog_ids[:2])
+        self.assertIsNotNone(response.data['next'])
+
+
+class PugOrUghCandidateQueueTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        self.user_pref = models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(5)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def get_next(self, pk):
+        request = self.factory.get(reverse('NextDog', kwargs={'status': 'undecided',
+                                                              'pk': pk}))
+        force_authenticate(request, user=self.user)
+
+        view = views.NextDogView.as_view()
+        return view(request, pk=pk, status='undecided')
+
+    def put_status(self, pk, status):
+        request = self.factory.put(reverse('UpdateStatus', kwargs={'status': status,
+                                                                   'pk': pk}))
+        force_authenticate(request, user=self.user)
+
+        view = views.UpdateStatus.as_view()
+        return view(request, pk=pk, status=status)
+
+    def test_queued_swipes_take_one_query(self):
+        """ Test that swipes after the first are served from the queue. """
+
+        response = self.get_next(-1)
+        self.assertEqual(response.data['id'], self.dog_ids[0])
+
+        for previous, expected in zip(self.dog_ids, self.dog_ids[1:]):
+            with self.assertNumQueries(1):
+                response = self.get_next(previous)
+            self.assertEqual(response.data['id'], expected)
+
+        response = self.get_next(self.dog_ids[-1])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_queue_skips_dogs_decided_elsewhere(self):
+        """ Test that a dog liked after the queue was built is skipped. """
+
+        self.get_next(-1)
+        self.put_status(self.dog_ids[1], 'liked')
+
+        response = self.get_next(self.dog_ids[0])
+
+        self.assertEqual(response.data['id'], self.dog_ids[2])
+
+    def test_queue_picks_up_undecided_dogs(self):
+        """ Test that a dog made undecided again is served. """
+
+        self.put_status(self.dog_ids[1], 'liked')
+        self.get_next(-1)
+        self.get_next(self.dog_ids[0])
+        self.put_status(self.dog_ids[1], 'undecided')
+
+        response = self.get_next(self.dog_ids[0])
+
+        self.assertEqual(response.data['id'], self.dog_ids[1])
+
+    def test_new_preferences_clear_the_queue(self):
+        """ Test that saving preferences rebuilds the queue. """
+
+        self.get_next(-1)
+
+        request = self.factory.put(reverse('user-pref'),
+                                   {'gender': 'f', 'age': 'b', 'size': 's'})
+        force_authenticate(request, user=self.user)
+        views.CreateUpdateViewUserPref.as_view()(request)
+
+        response = self.get_next(-1)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PugOrUghDogCacheTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        dog_cache.stats['hits'] = dog_cache.stats['misses'] = 0
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        self.dog = models.Dog.objects.create(
+            name='Muffin',
+            image_filename='3.jpg',
+            breed='Boxer',
+            age=24,
+            gender='f',
+            size='xl'
+        )
+
+    def get_list(self):
+        request = self.factory.get(reverse('ListDogs'))
+        force_authenticate(request, user=self.user)
+
+        view = views.ListDogsView.as_view()
+        return view(request)
+
+    def test_cached_list_reads_only_ids(self):
+        """ Test that a second list is served from cached payloads. """
+
+        self.get_list()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_list()
+
+        self.assertEqual(len(context), 1)
+        self.assertEqual(response.data,
+                         [serializers.DogSerializer(self.dog).data])
+        self.assertEqual(dog_cache.stats['hits'], 1)
+        self.assertEqual(dog_cache.stats['misses'], 1)
+
+    def test_save_invalidates_payload(self):
+        """ Test that saving a dog drops its stale payload. """
+
+        self.get_list()
+        self.dog.name = 'Biscuit'
+        self.dog.save()
+
+        response = self.get_list()
+
+        self.assertEqual(response.data[0]['name'], 'Biscuit')
+
+    def test_delete_invalidates_payload(self):
+        """ Test that a deleted dog is not served from the cache. """
+
+        dog_cache.get_payloads([self.dog.id])
+        dog_id = self.dog.id
+        self.dog.delete()
+
+        self.assertEqual(dog_cache.get_payloads([dog_id]), [])
+
+    def test_file_based_cache(self):
+        """ Test that payloads can be kept in a file based cache. """
+
+        with tempfile.TemporaryDirectory() as location:
+            caches = {
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                },
+                'dogs': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': location,
+                },
+            }
+            with override_settings(CACHES=caches, DOG_CACHE_ALIAS='dogs'):
+                dog_cache.get_payloads([self.dog.id])
+                with self.assertNumQueries(0):
+                    payloads = dog_cache.get_payloads([self.dog.id])
+
+        self.assertEqual(payloads[0]['name'], 'Muffin')
+
+    def test_long_list_keeps_version_stamps(self):
+        """ Test that caching a list of more dogs than the default cache
+        holds neither evicts the catalog versions nor its own payloads. """
+
+        models.Dog.objects.bulk_create(
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       age=10, gender='m', size='s')
+            for number in range(1000))
+        dog_ids = list(models.Dog.objects.values_list('id', flat=True))
+        versions = models.catalog_versions()
+
+        dog_cache.get_payloads(dog_ids)
+
+        self.assertEqual(models.catalog_versions(), versions)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(dog_cache.get_payloads(dog_ids)), 1001)
+
+    def test_long_list_is_read_in_chunks(self):
+        """ Test that missing payloads are read a chunk of ids at a time,
+        keeping every query under the database's parameter limit. """
+
+        models.Dog.objects.bulk_create(
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       age=10, gender='m', size='s')
+            for number in range(1000))
+        dog_ids = list(models.Dog.objects.order_by('-id')
+                       .values_list('id', flat=True))
+
+        with mock.patch.object(dog_cache, 'CHUNK_SIZE', 400), \
+                self.assertNumQueries(3):
+            payloads = dog_cache.get_payloads(dog_ids)
+
+        self.assertEqual([payload['id'] for payload in payloads], dog_ids)
+
+    def test_several_processes_need_shared_caches(self):
+        """ Test that the app refuses to run several processes on caches
+        each process keeps to itself. """
+
+        with self.settings(SERVER_PROCESSES=2):
+            with self.assertRaisesMessage(ImproperlyConfigured,
+                                          'default, dogs, stamps'):
+                apps.check_shared_caches()
+
+            shared = {
+                alias: {
+                    'BACKEND': 'django.core.cache.backends.filebased.'
+                               'FileBasedCache',
+                    'LOCATION': '/tmp/pugorugh-' + alias,
+                }
+                for alias in ('default', 'dogs', 'stamps')
+            }
+            with self.settings(CACHES=shared):
+                apps.check_shared_caches()
+
+        apps.check_shared_caches()
+
+    def test_stats_are_admin_only(self):
+        """ Test that only admins can see the cache counters. """
+
+        request = self.factory.get(reverse('DogCacheStats'))
+        force_authenticate(request, user=self.user)
+        response = views.DogCacheStatsView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = models.User.objects.create_superuser(
+            'testAdmin', 'ad@min.com', 'adminpassword')
+        force_authenticate(request, user=admin)
+        response = views.DogCacheStatsView.as_view()(request)
+        self.assertEqual(response.data, {'hits': 0, 'misses': 0})
+
+
+# Committed dogs would have their photos resized on a background thread,
+# into the source tree and while the test database goes away
+@override_settings(PROCESS_DOG_IMAGES_ON_CREATE=False)
+class PugOrUghDogCacheCommitTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        self.dog = models.Dog.objects.create(
+            name='Muffin',
+            image_filename='3.jpg',
+            breed='Boxer',
+            age=24,
+            gender='f',
+            size='xl'
+        )
+
+    def test_payload_cached_before_commit_is_dropped(self):
+        """ Test that a payload another request cached from the old row
+        while a change was being committed is not served after it. """
+
+        with transaction.atomic():
+            self.dog.name = 'Biscuit'
+            self.dog.save()
+            # Another request reads the committed row, still Muffin
+            dog_cache.get_cache().set(dog_cache.cache_key(self.dog.id),
+                                      {'id': self.dog.id, 'name': 'Muffin'})
+
+        self.assertEqual(dog_cache.get_payloads([self.dog.id])[0]['name'],
+                         'Biscuit')
+
+
+class PugOrUghImportDogsTests(APITestCase):
+    ROWS = [
+        {'name': 'Francesca', 'image_filename': '1.jpg', 'breed': 'Labrador',
+         'age': 72, 'gender': 'f', 'size': 'l'},
+        {'name': 'Hank', 'image_filename': '2.jpg', 'breed': 'French Bulldog',
+         'age': 14, 'gender': 'm', 'size': 's'},
+        {'name': 'Muffin', 'image_filename': '3.jpg', 'breed': 'Boxer',
+         'age': 24, 'gender': 'f', 'size': 'xl'},
+    ]
+
+    def setUp(self):
+        clear_caches()
+
+    def import_file(self, suffix, content, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix,
+                                         encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            out = io.StringIO()
+            call_command('import_dogs', file.name, stdout=out,
+                         stderr=io.StringIO(), **options)
+        return out.getvalue()
+
+    def imported(self):
+        return list(models.Dog.objects.order_by('image_filename')
+                    .values('name', 'image_filename', 'breed', 'age',
+                            'gender', 'size'))
+
+    def test_import_json(self):
+        """ Test importing a JSON array across several batches. """
+
+        output = self.import_file('.json', json.dumps(self.ROWS, indent=2),
+                                  batch_size=2)
+
+        self.assertEqual(self.imported(), self.ROWS)
+        self.assertEqual(
+            list(models.Dog.objects.order_by('image_filename')
+                 .values_list('age_stage', flat=True)),
+            ['a', 'a', 'a'])
+        self.assertIn('rows/s', output)
+
+    def test_import_json_lines(self):
+        """ Test importing one JSON object per line. """
+
+        self.import_file('.jsonl',
+                         '\n'.join(json.dumps(row) for row in self.ROWS))
+
+        self.assertEqual(self.imported(), self.ROWS)
+
+    def test_import_csv(self):
+        """ Test importing a CSV file with a header row. """
+
+        content = io.StringIO()
+        writer = csv.DictWriter(content, fieldnames=list(self.ROWS[0]))
+        writer.writeheader()
+        writer.writerows(self.ROWS)
+
+        self.import_file('.csv', content.getvalue())
+
+        self.assertEqual(self.imported(), self.ROWS)
+
+    def test_invalid_rows_are_skipped(self):
+        """ Test that rows failing validation are reported, not saved. """
+
+        rows = self.ROWS + [{'name': 'Nobody', 'age': 'old'}]
+
+        output = self.import_file('.json', json.dumps(rows))
+
+        self.assertEqual(models.Dog.objects.count(), 3)
+        self.assertIn('1 invalid', output)
+
+    def test_import_by_key_is_idempotent(self):
+        """ Test that importing twice by image_filename updates dogs in
+        place. """
+
+        self.import_file('.json', json.dumps(self.ROWS), key='image_filename')
+        dog = models.Dog.objects.get(image_filename='2.jpg')
+        dog_cache.get_payloads([dog.id])
+
+        rows = [dict(self.ROWS[1], age=100)]
+        self.import_file('.json', json.dumps(rows), key='image_filename')
+
+        self.assertEqual(models.Dog.objects.count(), 3)
+        dog.refresh_from_db()
+        self.assertEqual(dog.age_stage, 's')
+        self.assertEqual(dog_cache.get_payloads([dog.id])[0]['age'], 100)
+
+
+class PugOrUghCachedTokenTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        self.token = Token.objects.create(user=self.user)
+        self.dog = models.Dog.objects.create(
+            name='Muffin',
+            image_filename='3.jpg',
+            breed='Boxer',
+            age=24,
+            gender='f',
+            size='xl'
+        )
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def swipe(self):
+        url = reverse('UpdateStatus', kwargs={'status': 'liked',
+                                              'pk': self.dog.id})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(url)
+        return response, len(context)
+
+    def test_cached_token_saves_a_query(self):
+        """ Test that a repeat swipe skips the token lookup. """
+
+        response, first_count = self.swipe()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response, second_count = self.swipe()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(second_count, first_count - 1)
+
+    def test_deleted_token_is_evicted(self):
+        """ Test that a deleted token stops working at once. """
+
+        self.swipe()
+        self.token.delete()
+
+        response, count = self.swipe()
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_evicted(self):
+        """ Test that a deactivated user is no longer let in. """
+
+        self.swipe()
+        self.user.is_active = False
+        self.user.save()
+
+        response, count = self.swipe()
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PugOrUghBatchStatusTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(40)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def post_statuses(self, decisions):
+        request = self.factory.post(reverse('UpdateStatuses'), decisions,
+                                    format='json')
+        force_authenticate(request, user=self.user)
+
+        view = views.UpdateStatuses.as_view()
+        return view(request)
+
+    def test_batch_is_recorded(self):
+        """ Test that a batch of swipes is recorded with per item
+        results. """
+
+        models.UserDog.objects.create(user=self.user, dog_id=self.dog_ids[1],
+                                      status='l')
+        decisions = [
+            {'dog': self.dog_ids[0], 'status': 'liked'},
+            {'dog': self.dog_ids[1], 'status': 'disliked'},
+            {'dog': self.dog_ids[-1] + 1, 'status': 'liked'},
+        ]
+
+        response = self.post_statuses(decisions)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'dog': self.dog_ids[0], 'status': 'l'},
+            {'dog': self.dog_ids[1], 'status': 'd'},
+            {'dog': self.dog_ids[-1] + 1, 'status': 'l',
+             'error': 'Dog does not exist.'},
+        ])
+        self.assertEqual(
+            dict(models.UserDog.objects.values_list('dog_id', 'status')),
+            {self.dog_ids[0]: 'l', self.dog_ids[1]: 'd'})
+
+    def test_batch_query_count_is_constant(self):
+        """ Test that a bigger batch does not run more queries. """
+
+        query_counts = []
+        for dog_ids in (self.dog_ids[:2], self.dog_ids):
+            decisions = [{'dog': dog_id, 'status': 'liked'}
+                         for dog_id in dog_ids]
+            with CaptureQueriesContext(connection) as context:
+                self.post_statuses(decisions)
+            query_counts.append(len(context))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(models.UserDog.objects.filter(status='l').count(), 40)
+
+    def test_last_swipe_on_a_dog_wins(self):
+        """ Test that repeated swipes on one dog keep the last one. """
+
+        self.post_statuses([
+            {'dog': self.dog_ids[0], 'status': 'liked'},
+            {'dog': self.dog_ids[0], 'status': 'undecided'},
+        ])
+
+        self.assertIsNone(models.UserDog.objects.get().status)
+
+    def test_invalid_batch_is_rejected(self):
+        """ Test that a batch with a bad status writes nothing. """
+
+        response = self.post_statuses([
+            {'dog': self.dog_ids[0], 'status': 'liked'},
+            {'dog': self.dog_ids[1], 'status': 'loved'},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(models.UserDog.objects.count(), 0)
+
+
+class PugOrUghBenchmarkTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_benchmark_covers_every_route(self):
+        """ Test that the benchmark reports on every named API route. """
+
+        user = benchmarks.seed(dogs=60, users=2, swipes=10)
+        self.assertEqual(models.Dog.objects.count(), 60)
+        self.assertEqual(models.UserDog.objects.filter(user=user).count(), 10)
+
+        results = benchmarks.run(user, repeat=2)
+
+        route_names = {pattern.name for pattern in
+                       get_resolver('pugorugh.urls').url_patterns
+                       if pattern.name}
+        self.assertEqual({result['name'].split(':')[0] for result in results},
+                         route_names | {'index'})
+        for result in results:
+            self.assertLess(result['status'], 400, result)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_kb'], 0)
+
+
+class PugOrUghDogImageTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.dog = models.Dog.objects.create(
+            name='Muffin',
+            image_filename='muffin.jpg',
+            breed='Boxer',
+            age=24,
+            gender='f',
+            size='xl'
+        )
+
+    def test_original_photo_until_resized(self):
+        """ Test that a dog without derivatives points at its photo. """
+
+        data = serializers.DogSerializer(self.dog).data
+
+        self.assertEqual(data['image_url'], '/static/images/dogs/muffin.jpg')
+        self.assertIsNone(data['images'])
+
+    @unittest.skipIf(images.Image is None, 'Pillow is not installed')
+    def test_process_dog_images(self):
+        """ Test that the command writes hashed derivatives and records
+        them on the dog. """
+
+        dog_cache.get_payloads([self.dog.id])
+
+        with tempfile.TemporaryDirectory() as source_dir:
+            derived_dir = path.join(source_dir, 'derived')
+            images.Image.new('RGB', (1600, 1200), 'tan').save(
+                path.join(source_dir, 'muffin.jpg'))
+
+            with mock.patch.object(images, 'SOURCE_DIR', source_dir), \
+                    mock.patch.object(images, 'DERIVED_DIR', derived_dir):
+                call_command('process_dog_images', workers=1,
+                             stdout=io.StringIO())
+
+                self.dog.refresh_from_db()
+                image_hash = self.dog.image_hash
+                self.assertEqual(image_hash, images.content_hash(
+                    path.join(source_dir, 'muffin.jpg')))
+                for size, width in images.SIZES:
+                    for extension, options in images.FORMATS:
+                        filename = path.join(derived_dir, '{}-{}.{}'.format(
+                            image_hash, size, extension))
+                        with images.Image.open(filename) as derived:
+                            self.assertEqual(derived.width, width)
+
+        payload = dog_cache.get_payloads([self.dog.id])[0]
+        self.assertEqual(
+            payload['image_url'],
+            '/static/images/dogs/derived/{}-card.jpg'.format(image_hash))
+        self.assertEqual(
+            payload['images']['thumb']['webp'],
+            '/static/images/dogs/derived/{}-thumb.webp'.format(image_hash))
+
+    def test_photo_outside_source_dir_is_not_read(self):
+        """ Test that filenames leading out of the photo folder are neither
+        read nor accepted. """
+
+        with mock.patch.object(images, 'content_hash') as content_hash:
+            for filename in ('../../settings.py', '/etc/passwd',
+                             'derived/../../../images.py'):
+                self.assertIsNone(images.source_path(filename))
+                self.assertIsNone(images.process_image(filename))
+        content_hash.assert_not_called()
+        self.assertEqual(images.source_path('muffin.jpg'),
+                         path.join(path.realpath(images.SOURCE_DIR),
+                                   'muffin.jpg'))
+
+        user = models.User.objects.create(username='test', password='test')
+        request = APIRequestFactory().post(reverse('ListDogs'), {
+            'name': 'Sneaky', 'image_filename': '/etc/passwd',
+            'age': 24, 'gender': 'f', 'size': 's',
+        }, format='json')
+        force_authenticate(request, user=user)
+        response = views.ListDogsView.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image_filename', response.data)
+        self.assertFalse(models.Dog.objects.filter(name='Sneaky').exists())
+
+
+class PugOrUghPrefetchTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+        self.user = models.User.objects.create(username='test', password='test')
+        models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(15)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def get_next(self, status, data):
+        request = self.factory.get(
+            reverse('NextDog', kwargs={'status': status, 'pk': -1}), data)
+        force_authenticate(request, user=self.user)
+
+        view = views.NextDogView.as_view()
+        return view(request, pk=-1, status=status)
+
+    def test_undecided_prefetch(self):
+        """ Test that the next undecided dog comes with the ones after it. """
+
+        response = self.get_next('undecided', {'prefetch': 3})
+
+        self.assertEqual(response.data['id'], self.dog_ids[0])
+        self.assertEqual([dog['id'] for dog in response.data['upcoming']],
+                         self.dog_ids[1:4])
+        self.assertEqual(response.data['upcoming'][0]['image_url'],
+                         '/static/images/dogs/1.jpg')
+
+    def test_liked_prefetch_is_one_id_query(self):
+        """ Test that prefetching liked dogs reads all their ids at once. """
+
+        for dog_id in self.dog_ids[:5]:
+            models.UserDog.objects.create(user=self.user, dog_id=dog_id,
+                                          status='l')
+        dog_cache.get_payloads(self.dog_ids)
+
+        with self.assertNumQueries(1):
+            response = self.get_next('liked', {'prefetch': 10})
+
+        self.assertEqual([dog['id'] for dog in response.data['upcoming']],
+                         self.dog_ids[1:5])
+
+    def test_prefetch_is_capped(self):
+        """ Test that at most max_prefetch dogs are preloaded. """
+
+        response = self.get_next('undecided', {'prefetch': 100})
+
+        self.assertEqual(len(response.data['upcoming']),
+                         views.NextDogView.max_prefetch)
+
+    def test_no_prefetch_keeps_the_payload(self):
+        """ Test that the plain next dog response is unchanged. """
+
+        response = self.get_next('undecided', {})
+
+        self.assertNotIn('upcoming', response.data)
+
+
+class PugOrUghStaticFilesTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.TemporaryDirectory()
+        cls.production = override_settings(
+            STATIC_ROOT=cls.static_root.name,
+            STATICFILES_STORAGE=(
+                'whitenoise.storage.CompressedManifestStaticFilesStorage'),
+        )
+        cls.production.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.production.disable()
+        cls.static_root.cleanup()
+        super().tearDownClass()
+
+    def test_cold_page_load(self):
+        """ Test that a cold page load gets hashed, compressed files with
+        far-future cache headers, and measure its bytes. """
+
+        compressed = benchmarks.cold_page_load(Client())
+        uncompressed = benchmarks.cold_page_load(Client(), encoding='identity')
+
+        self.assertEqual(len(compressed['files']), 12)
+        for file in compressed['files']:
+            self.assertEqual(file['status'], 200, file['url'])
+            self.assertRegex(file['url'], r'\.[0-9a-f]{12}\.(js|css)$')
+            self.assertIn('immutable', file['cache_control'])
+            self.assertIn(file['content_encoding'], ('gzip', 'br'))
+        self.assertLess(compressed['total_bytes'],
+                        uncompressed['total_bytes'] / 2)
+
+    def test_missing_photo_is_not_an_error(self):
+        """ Test that a photo left out of the manifest keeps its plain
+        URL. """
+
+        dog = models.Dog(name='Muffin', image_filename='missing.jpg',
+                         breed='Boxer', age=24, gender='f', size='xl')
+
+        self.assertEqual(images.image_url(dog),
+                         '/static/images/dogs/missing.jpg')
+        self.assertRegex(images.image_url(models.Dog(image_filename='1.jpg')),
+                         r'^/static/images/dogs/1\.[0-9a-f]{12}\.jpg$')
+
+
+    def test_uncollected_derivatives_keep_original_photo(self):
+        """ Test that a dog resized since collectstatic points at its
+        original photo until its derivatives are collected. """
+
+        dog = models.Dog(name='Muffin', image_filename='1.jpg',
+                         image_hash='0123456789abcdef', breed='Boxer',
+                         age=24, gender='f', size='xl')
+
+        self.assertRegex(images.image_url(dog),
+                         r'^/static/images/dogs/1\.[0-9a-f]{12}\.jpg$')
+        self.assertIsNone(images.image_urls(dog))
+
+        derived_dir = path.join(self.static_root.name, 'images', 'dogs',
+                                'derived')
+        os.makedirs(derived_dir, exist_ok=True)
+        for size, width in images.SIZES:
+            for extension, options in images.FORMATS:
+                open(path.join(derived_dir, images.derived_filename(
+                    dog.image_hash, size, extension)), 'wb').close()
+
+        self.assertEqual(images.image_url(dog),
+                         '/static/images/dogs/derived/0123456789abcdef-card.jpg')
+
+
+class PugOrUghConcurrentSwipeTests(SimpleTestCase):
+    def run_swipes(self, profile):
+        """ Run the swipe harness in a fresh process for a database
+        profile. """
+
+        PROJ_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, path.join(PROJ_DIR, 'manage.py'),
+             'swipe_concurrency', '--writers', '8', '--swipes', '40',
+             '--dogs', '200'],
+            env=dict(os.environ, DJANGO_DB_PROFILE=profile),
+            timeout=300)
+        return json.loads(output.decode())
+
+    def test_sqlite_profile(self):
+        """ Test that concurrent single and batch writers on SQLite all
+        succeed with WAL and keep the status counts right. """
+
+        report = self.run_swipes('sqlite')
+
+        self.assertEqual(report['journal_mode'], 'wal')
+        self.assertEqual(report['swipes'], 320)
+        self.assertEqual(report['errors'], 0)
+        self.assertTrue(report['counts_match'])
+
+    def test_bundled_database_keeps_its_journal(self):
+        """ Test that connecting to the checked in database does not switch
+        it to WAL, which would rewrite the file. """
+
+        for name, tuned in ((settings.BUNDLED_SQLITE_PATH, False),
+                            ('/tmp/pugorugh.sqlite3', True)):
+            connection = mock.MagicMock(vendor='sqlite',
+                                        settings_dict={'NAME': name})
+            signals.tune_sqlite_connection(sender=None, connection=connection)
+            self.assertEqual(connection.cursor.called, tuned)
+
+    @unittest.skipUnless(os.environ.get('POSTGRES_HOST'),
+                         'POSTGRES_HOST is not set')
+    def test_postgresql_profile(self):
+        """ Test that concurrent writers on PostgreSQL all succeed. """
+
+        report = self.run_swipes('postgresql')
+
+        self.assertEqual(report['database'], 'postgresql')
+        self.assertEqual(report['errors'], 0)
+        self.assertTrue(report['counts_match'])
+
+
+@unittest.skipIf(importlib.util.find_spec('asgiref') is None,
+                 'asgiref is not installed')
+class PugOrUghAsgiTests(SimpleTestCase):
+    def call(self, application, scope, body=b''):
+        """ Run one ASGI request and return the messages sent. """
+
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(application(scope, receive, send))
+        return messages
+
+    def test_wsgi_application_is_served(self):
+        """ Test that a request goes through Django and back. """
+
+        from backend.asgi import application
+
+        messages = self.call(application, {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET',
+            'path': '/api/', 'query_string': b'format=json',
+            'headers': [(b'host', b'testserver')],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        })
+
+        self.assertEqual(messages[0]['status'], 401)
+        self.assertIn((b'content-type', b'application/json'),
+                      messages[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertIn(b'credentials', body)
+        self.assertFalse(messages[-1].get('more_body'))
+
+
+class PugOrUghStatusSummaryTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.client.force_authenticate(user=self.user)
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(5)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def put_status(self, pk, status):
+        return self.client.put(
+            reverse('UpdateStatus', kwargs={'pk': pk, 'status': status}))
+
+    def get_summary(self):
+        return self.client.get(reverse('DogStatusSummary')).data
+
+    def test_swipes_are_counted(self):
+        """ Test that the summary follows likes, dislikes and undos. """
+
+        self.assertEqual(self.get_summary(),
+                         {'liked': 0, 'disliked': 0, 'undecided': 5})
+
+        self.put_status(self.dog_ids[0], 'liked')
+        self.put_status(self.dog_ids[1], 'liked')
+        self.put_status(self.dog_ids[1], 'liked')
+        self.put_status(self.dog_ids[2], 'disliked')
+        self.put_status(self.dog_ids[0], 'disliked')
+        self.put_status(self.dog_ids[2], 'undecided')
+        self.put_status(self.dog_ids[-1] + 1, 'liked')
+
+        self.assertEqual(self.get_summary(),
+                         {'liked': 1, 'disliked': 1, 'undecided': 3})
+
+    def test_batch_is_counted(self):
+        """ Test that a batch of swipes is counted. """
+
+        self.put_status(self.dog_ids[0], 'liked')
+        self.client.post(reverse('UpdateStatuses'), [
+            {'dog': self.dog_ids[0], 'status': 'disliked'},
+            {'dog': self.dog_ids[1], 'status': 'liked'},
+            {'dog': self.dog_ids[2], 'status': 'liked'},
+            {'dog': self.dog_ids[2], 'status': 'undecided'},
+        ], format='json')
+
+        self.assertEqual(self.get_summary(),
+                         {'liked': 1, 'disliked': 1, 'undecided': 3})
+
+    def test_added_and_removed_dogs_are_counted(self):
+        """ Test that new dogs are undecided and deleted dogs are no
+        longer counted. """
+
+        self.put_status(self.dog_ids[0], 'liked')
+        self.put_status(self.dog_ids[1], 'disliked')
+        self.get_summary()
+
+        models.Dog.objects.create(name='New', image_filename='2.jpg',
+                                  age=3, gender='f', size='s')
+        models.Dog.objects.filter(id__in=self.dog_ids[:2]).delete()
+
+        self.assertEqual(self.get_summary(),
+                         {'liked': 0, 'disliked': 0, 'undecided': 4})
+
+    def test_summary_is_one_query(self):
+        """ Test that the summary reads one row however many swipes the
+        user has. """
+
+        for dog_id in self.dog_ids:
+            self.put_status(dog_id, 'liked')
+        self.get_summary()
+
+        with self.assertNumQueries(1):
+            summary = self.get_summary()
+        self.assertEqual(summary['liked'], 5)
+
+    def test_rebuild_status_counts(self):
+        """ Test that the command recounts statuses written around the
+        counters. """
+
+        models.UserDog.objects.bulk_create([
+            models.UserDog(user=self.user, dog_id=self.dog_ids[0], status='l'),
+            models.UserDog(user=self.user, dog_id=self.dog_ids[1], status='d'),
+            models.UserDog(user=self.user, dog_id=self.dog_ids[2], status=None),
+        ])
+        self.assertEqual(self.get_summary()['liked'], 0)
+
+        call_command('rebuild_status_counts', stdout=io.StringIO())
+
+        self.assertEqual(self.get_summary(),
+                         {'liked': 1, 'disliked': 1, 'undecided': 3})
+
+
+class PugOrUghEligibleDogTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.user_pref = models.UserPref.objects.create(
+            user=self.user, gender='f', age='b,y', size='s,m')
+        benchmarks.seed(dogs=300, users=1, swipes=0)
+
+    def test_same_candidates_as_the_database(self):
+        """ Test that the index finds the same dogs as the filtered
+        query. """
+
+        dog_ids = list(models.Dog.objects.order_by('id')
+                       .values_list('id', flat=True))
+        models.UserDog.objects.set_statuses(
+            self.user, {dog_id: 'l' for dog_id in dog_ids[::3]})
+
+        for gender, age, size in (('f', 'b,y', 's,m'),
+                                  ('m,f', 'b,y,a,s', 's,m,l,xl'),
+                                  ('m', 's', 'xl')):
+            self.user_pref.gender = gender
+            self.user_pref.age = age
+            self.user_pref.size = size
+            self.user_pref.save()
+            for after in (-1, dog_ids[100]):
+                with self.settings(ELIGIBLE_DOG_INDEX=False):
+                    expected = candidates.fetch_candidates(self.user, after)
+                self.assertEqual(
+                    candidates.fetch_candidates(self.user, after), expected)
+
+    def test_new_dogs_are_added_in_place(self):
+        """ Test that a new dog is added to the index without reloading
+        it. """
+
+        candidates.fetch_candidates(self.user, -1)
+        combos = eligible.index.combos
+
+        dog = models.Dog.objects.create(name='New', image_filename='1.jpg',
+                                        age=3, gender='f', size='s')
+
+        self.assertEqual(candidates.fetch_candidates(self.user, dog.id - 1),
+                         [dog.id])
+        self.assertIs(eligible.index.combos, combos)
+
+    def test_changed_dogs_reload_the_index(self):
+        """ Test that a dog no longer matching is dropped. """
+
+        dog_id = candidates.fetch_candidates(self.user, -1)[0]
+
+        dog = models.Dog.objects.get(id=dog_id)
+        dog.gender = 'm'
+        dog.save()
+
+        self.assertNotIn(dog_id, candidates.fetch_candidates(self.user, -1))
+
+
+@unittest.skipIf(ranking.numpy is None, 'NumPy is not installed')
+@override_settings(PROCESS_DOG_IMAGES_ON_CREATE=False)
+class PugOrUghCatalogCommitTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_versions_move_again_on_commit(self):
+        """ Test that a process reading the catalog while a change is being
+        committed finds a newer version once it is. """
+
+        with transaction.atomic():
+            dog = models.Dog.objects.create(
+                name='Muffin', image_filename='3.jpg', breed='Boxer',
+                age=24, gender='f', size='xl')
+            # Another process loading the catalog now misses the dog
+            seen = models.catalog_versions()
+        version, changed = models.catalog_versions()
+        self.assertGreater(version, seen[0])
+        self.assertEqual(changed, seen[1])
+
+        with transaction.atomic():
+            dog.age = 100
+            dog.save()
+            seen = models.catalog_versions()
+        version, changed = models.catalog_versions()
+        # Indexes loaded at the seen version are built again
+        self.assertGreater(changed, seen[0])
+
+    def test_dog_committed_late_is_loaded(self):
+        """ Test that a dog committed after one with a higher id is found
+        by the indexes, which only load ids above the last they have. """
+
+        user = models.User.objects.create(username='test', password='test')
+        user_pref = models.UserPref.objects.create(
+            user=user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        dog = dict(image_filename='3.jpg', breed='Boxer', age=24,
+                   gender='f', size='xl')
+        models.Dog.objects.create(id=100, name='Early', **dog)
+        self.assertEqual(eligible.ids_after(user_pref, -1, 10), [100])
+
+        # Given its id before the first dog but committed after it
+        models.Dog.objects.create(id=50, name='Late', **dog)
+
+        self.assertEqual(eligible.ids_after(user_pref, -1, 10), [50, 100])
+        models.Dog.objects.create(id=150, name='Next', **dog)
+        self.assertEqual(eligible.ids_after(user_pref, -1, 10),
+                         [50, 100, 150])
+
+
+class PugOrUghRankingTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        self.client.force_authenticate(user=self.user)
+        models.Dog.objects.bulk_create([
+            models.Dog(name=str(number), image_filename='1.jpg', age=20,
+                       gender='f', size='m',
+                       breed=('Boxer', 'Pug', 'Beagle')[number % 3])
+            for number in range(30)
+        ])
+        self.dogs = {dog.name: dog.id for dog in models.Dog.objects.all()}
+
+    def next_ranked(self, pk=-1, **params):
+        url = reverse('NextDog', kwargs={'pk': pk, 'status': 'undecided'})
+        return self.client.get(url, dict(params, order='ranked'))
+
+    def test_liked_breed_comes_first(self):
+        """ Test that ranked dogs share the breed of the liked dogs, in id
+        order among equals. """
+
+        models.UserDog.objects.set_statuses(
+            self.user, {self.dogs['1']: 'l', self.dogs['4']: 'l'})
+
+        response = self.next_ranked(prefetch=2)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([response.data['id']] +
+                         [dog['id'] for dog in response.data['upcoming']],
+                         [self.dogs['7'], self.dogs['10'], self.dogs['13']])
+
+    def test_skipped_dog_is_left_out(self):
+        """ Test that the dog being skipped is not given again. """
+
+        models.UserDog.objects.set_statuses(self.user, {self.dogs['1']: 'l'})
+
+        response = self.next_ranked(pk=self.dogs['4'])
+
+        self.assertEqual(response.data['id'], self.dogs['7'])
+
+    def test_ranked_walk_moves_on(self):
+        """ Test that skipping dog after dog never gives one again, and
+        that a new walk starts over. """
+
+        models.UserDog.objects.set_statuses(self.user, {self.dogs['1']: 'l'})
+
+        seen = []
+        pk = -1
+        for _ in range(6):
+            pk = self.next_ranked(pk=pk).data['id']
+            seen.append(pk)
+
+        self.assertEqual(seen, [self.dogs[name]
+                                for name in ('4', '7', '10', '13', '16', '19')])
+        self.assertEqual(self.next_ranked().data['id'], self.dogs['4'])
+
+    def test_no_likes_keeps_id_order(self):
+        """ Test that without likes the dogs come in id order. """
+
+        response = self.next_ranked()
+
+        self.assertEqual(response.data['id'], self.dogs['0'])
+
+    def test_bad_order(self):
+        """ Test that an unknown order is rejected. """
+
+        response = self.client.get(
+            reverse('NextDog', kwargs={'pk': -1, 'status': 'undecided'}),
+            {'order': 'best'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_imported_dogs_are_appended(self):
+        """ Test that imported dogs are added to the matrix without
+        building it again. """
+
+        models.UserDog.objects.set_statuses(self.user, {self.dogs['1']: 'l'})
+        self.next_ranked()
+        models.Dog.objects.bulk_create([
+            models.Dog(name='New', image_filename='1.jpg', age=20,
+                       gender='f', size='m', breed='Pug')])
+        new_id = models.Dog.objects.get(name='New').id
+
+        with mock.patch.object(ranking.matrix, 'reset') as reset:
+            self.assertEqual(ranking.rank([self.dogs['1']],
+                                          [self.dogs['0'], new_id], 1),
+                             [new_id])
+        reset.assert_not_called()
+        self.assertEqual(ranking.matrix.last_id, new_id)
+
+    def test_changed_dogs_rebuild_the_matrix(self):
+        """ Test that a dog's new breed is used for ranking. """
+
+        models.UserDog.objects.set_statuses(self.user, {self.dogs['1']: 'l'})
+        self.next_ranked()
+        dog = models.Dog.objects.get(id=self.dogs['0'])
+        dog.breed = 'pug '
+        dog.save()
+
+        self.assertEqual(self.next_ranked().data['id'], self.dogs['0'])
+
+
+class PugOrUghSearchTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.client.force_authenticate(user=self.user)
+        models.Dog.objects.bulk_create([
+            models.Dog(name=name, image_filename='1.jpg', age=age,
+                       gender=gender, size='m', breed=breed)
+            for name, breed, age, gender in (
+                ('Max', 'Labrador Retriever', 3, 'm'),
+                ('Maxine', 'labrador', 30, 'f'),
+                ('Bella', 'Golden Retriever', 30, 'f'),
+                ('Buddy', 'Beagle', 30, 'm'),
+                ('Luna', '', 30, 'f'),
+            )
+        ])
+        self.dogs = {dog.name: dog.id for dog in models.Dog.objects.all()}
+
+    def search(self, **params):
+        response = self.client.get(reverse('SearchDogs'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [dog['name'] for dog in response.data['results']]
+
+    def test_breed_prefix_of_any_word(self):
+        """ Test that a breed matches from the start of any of its words,
+        in any case. """
+
+        self.assertEqual(self.search(breed='LAB'), ['Max', 'Maxine'])
+        self.assertEqual(self.search(breed='retr'), ['Max', 'Bella'])
+        self.assertEqual(self.search(breed='golden  ret'), ['Bella'])
+        self.assertEqual(self.search(breed='etriever'), [])
+
+    def test_fuzzy_breed(self):
+        """ Test that a misspelt breed is only found when fuzzy. """
+
+        self.assertEqual(self.search(breed='labrdor'), [])
+        self.assertEqual(self.search(breed='labrdor', fuzzy='true'),
+                         ['Max', 'Maxine'])
+        self.assertEqual(self.search(breed='beegle', fuzzy='true'), ['Buddy'])
+
+    def test_filters(self):
+        """ Test that the gender, size and age filters apply to breed and
+        name searches. """
+
+        self.assertEqual(self.search(breed='lab', gender='f'), ['Maxine'])
+        self.assertEqual(self.search(breed='lab', age='b'), ['Max'])
+        self.assertEqual(self.search(breed='lab', size='s'), [])
+        self.assertEqual(self.search(name='max', gender='f'), ['Maxine'])
+        self.assertEqual(self.search(name='max', age='b,y'), ['Max'])
+
+    def test_name_prefix(self):
+        """ Test that names match by prefix, and with a breed too. """
+
+        self.assertEqual(self.search(name='MA'), ['Max', 'Maxine'])
+        self.assertEqual(self.search(name='max', breed='labrador r'), ['Max'])
+        self.assertEqual(self.search(name='lu'), ['Luna'])
+
+    def test_paging(self):
+        """ Test that results come a page at a time after a dog id. """
+
+        response = self.client.get(reverse('SearchDogs'),
+                                   {'breed': 'retriever', 'page_size': 1})
+
+        self.assertEqual([dog['name'] for dog in response.data['results']],
+                         ['Max'])
+        self.assertIn('after={}'.format(self.dogs['Max']),
+                      response.data['next'])
+        self.assertEqual(self.search(breed='retriever',
+                                     after=self.dogs['Max']), ['Bella'])
+
+    def test_bad_queries(self):
+        """ Test that a search needs a query and known codes. """
+
+        for params in ({}, {'gender': 'f'}, {'breed': ' '},
+                       {'breed': 'lab', 'size': 'huge'}):
+            response = self.client.get(reverse('SearchDogs'), params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+    def test_saved_dogs_are_found(self):
+        """ Test that new and changed dogs are found by their new breed and
+        name. """
+
+        self.search(breed='lab')
+        dog = models.Dog.objects.create(name='Rex', image_filename='1.jpg',
+                                        age=30, gender='m', size='m',
+                                        breed='Labradoodle')
+        self.assertEqual(self.search(breed='labrad'),
+                         ['Max', 'Maxine', 'Rex'])
+
+        dog.breed = 'Poodle'
+        dog.name = 'Rexy'
+        dog.save()
+        self.assertEqual(self.search(breed='labrad'), ['Max', 'Maxine'])
+        self.assertEqual(self.search(breed='poo'), ['Rexy'])
+        self.assertEqual(self.search(name='rexy'), ['Rexy'])
+
+    def test_payloads_have_no_name_key(self):
+        """ Test that the search key stays out of the dog payloads. """
+
+        response = self.client.get(reverse('SearchDogs'), {'name': 'max'})
+
+        self.assertNotIn('name_key', response.data['results'][0])
+
+
+class PugOrUghConditionalGetTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.other = models.User.objects.create(username='other',
+                                                password='test')
+        models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        self.client.force_authenticate(user=self.user)
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}'.format(number), image_filename='1.jpg',
+                       breed='Labrador', age=24, gender='m', size='l')
+            for number in range(5)
+        ])
+        self.dog_ids = list(
+            models.Dog.objects.order_by('id').values_list('id', flat=True))
+
+    def assertNotModified(self, url, response):
+        """Check that sending back the response's ETag gives a 304 without
+        any query."""
+        with self.assertNumQueries(0):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(again['ETag'], response['ETag'])
+        self.assertEqual(again.content, b'')
+
+    def assertModified(self, url, response):
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(again['ETag'], response['ETag'])
+        return again
+
+    def test_dog_list(self):
+        """ Test that the dog list is not sent again until the catalog
+        changes. """
+
+        url = reverse('ListDogs')
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotModified(url, response)
+
+        models.Dog.objects.create(name='New', image_filename='1.jpg',
+                                  age=3, gender='f', size='s')
+        response = self.assertModified(url, response)
+        self.assertEqual(len(response.data), 6)
+
+        models.Dog.objects.set_image_hashes({'1.jpg': 'abcdef0123456789'})
+        self.assertModified(url, response)
+
+    def test_pages_and_formats_have_their_own_etags(self):
+        """ Test that an ETag only matches the same query and media
+        type. """
+
+        url = reverse('ListDogs')
+        response = self.client.get(url)
+
+        for other in (url + '?page_size=2', url + '?format=api'):
+            self.assertEqual(self.client.get(other, HTTP_IF_NONE_MATCH=response['ETag'])
+                             .status_code, status.HTTP_200_OK)
+
+    def test_status_list(self):
+        """ Test that a status list changes with the user's swipes only. """
+
+        url = reverse('ListDogsStatus', kwargs={'status': 'liked'})
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        models.UserDog.objects.create(user=self.other, dog_id=self.dog_ids[0],
+                                      status='l')
+        self.assertNotModified(url, response)
+
+        self.client.put(reverse('UpdateStatus', kwargs={
+            'pk': self.dog_ids[0], 'status': 'liked'}))
+        response = self.assertModified(url, response)
+        self.assertEqual([dog['id'] for dog in response.data],
+                         [self.dog_ids[0]])
+
+    def test_preferences(self):
+        """ Test that the preferences are sent again once changed. """
+
+        url = reverse('user-pref')
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        self.client.put(url, {'gender': 'f', 'age': 'b', 'size': 's'},
+                        format='json')
+        response = self.assertModified(url, response)
+        self.assertEqual(response.data['gender'], 'f')
+
+    def as_process(self, stamps):
+        """Settings of one of two server processes, with the given stamp
+        cache. Each use starts from new cache objects, as another process
+        would."""
+        return override_settings(
+            SERVER_PROCESSES=2,
+            CACHES=dict(settings.CACHES, **{settings.STAMP_CACHE_ALIAS: stamps}))
+
+    def test_process_local_stamps_are_not_trusted(self):
+        """ Test that processes with stamps of their own always send the
+        list in full, so a swipe made in one shows up in the other. """
+
+        url = reverse('ListDogsStatus', kwargs={'status': 'liked'})
+        first = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                 'LOCATION': 'first-process'}
+        second = dict(first, LOCATION='second-process')
+
+        with self.as_process(second):
+            response = self.client.get(url)
+        self.assertNotIn('ETag', response)
+
+        with self.as_process(first):
+            self.client.put(reverse('UpdateStatus', kwargs={
+                'pk': self.dog_ids[0], 'status': 'liked'}))
+        with self.as_process(second):
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([dog['id'] for dog in response.data],
+                         [self.dog_ids[0]])
+
+    def test_shared_stamps_across_processes(self):
+        """ Test that a swipe, or stamps forgotten, in one process is seen
+        by another sharing the stamp cache. """
+
+        url = reverse('ListDogsStatus', kwargs={'status': 'liked'})
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory,
+            }
+            with self.as_process(shared):
+                response = self.client.get(url)
+            with self.as_process(shared):
+                self.client.put(reverse('UpdateStatus', kwargs={
+                    'pk': self.dog_ids[0], 'status': 'liked'}))
+            with self.as_process(shared):
+                response = self.assertModified(url, response)
+                self.assertNotModified(url, response)
+            with self.as_process(shared):
+                caches[settings.STAMP_CACHE_ALIAS].clear()
+            with self.as_process(shared):
+                self.assertModified(url, response)
+
+    def test_if_modified_since_is_not_trusted(self):
+        """ Test that a date is never taken to mean the copy is current,
+        as a second swipe in the same second would not change it. """
+
+        url = reverse('ListDogsStatus', kwargs={'status': 'liked'})
+        like = reverse('UpdateStatus', kwargs={
+            'pk': self.dog_ids[0], 'status': 'liked'})
+        self.client.put(like)
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+
+        self.client.put(reverse('UpdateStatus', kwargs={
+            'pk': self.dog_ids[1], 'status': 'liked'}))
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+
+class PugOrUghRendererTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.client.force_authenticate(user=self.user)
+        models.Dog.objects.bulk_create([
+            models.Dog(name='Dog {}\u2028'.format(number),
+                       image_filename='1.jpg', breed='Labrador', age=24,
+                       gender='m', size='l')
+            for number in range(50)
+        ])
+        self.url = reverse('ListDogs')
+
+    def test_json_matches_drf(self):
+        """ Test that the fast JSON is the same as DRF's JSON. """
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_json_without_orjson(self):
+        """ Test that JSON is rendered by DRF without orjson, and when
+        indented JSON is asked for. """
+
+        with mock.patch.object(renderers, 'orjson', None):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+        response = self.client.get(
+            self.url, HTTP_ACCEPT='application/json; indent=2')
+        self.assertIn(b'\n  ', response.content)
+
+    @unittest.skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        """ Test that MessagePack is given when asked for, by header or
+        format. """
+
+        json_data = self.client.get(self.url).json()
+        for response in (
+                self.client.get(self.url, HTTP_ACCEPT='application/msgpack'),
+                self.client.get(self.url, {'format': 'msgpack'})):
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(renderers.msgpack.unpackb(response.content,
+                                                       raw=False),
+                             json_data)
+
+    def test_large_bodies_are_gzipped(self):
+        """ Test that a large list is gzipped for clients accepting it, and
+        a small body is not. """
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)),
+                         self.client.get(self.url).json())
+
+        response = self.client.get(reverse('DogStatusSummary'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        with self.settings(GZIP_MIN_BYTES=None):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_gzipped_copy_is_not_sent_again(self):
+        """ Test that the weakened ETag of a gzipped list still gives a
+        304. """
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(
+            self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip',
+                            HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            status.HTTP_304_NOT_MODIFIED)
+
+
+class PugOrUghBitmapTests(SimpleTestCase):
+    def test_sparse_and_dense_ids(self):
+        """ Test that a bitmap holds the same ids as a set, in order. """
+
+        rand = random.Random(0)
+        for count in (10, 5000, 100000):
+            ids = set(rand.sample(range(200000), count))
+            bitmap = status_index.Bitmap(ids)
+            for dog_id in rand.sample(sorted(ids), count // 2):
+                bitmap.discard(dog_id)
+                ids.discard(dog_id)
+
+            self.assertEqual(len(bitmap), len(ids))
+            self.assertEqual(list(bitmap), sorted(ids))
+            for after in (-1, 65535, 65536, 150000):
+                self.assertEqual(list(bitmap.iter_after(after)),
+                                 sorted(dog_id for dog_id in ids
+                                        if dog_id > after))
+            self.assertEqual([dog_id in bitmap for dog_id in range(0, 200000, 7)],
+                             [dog_id in ids for dog_id in range(0, 200000, 7)])
+
+
+@override_settings(STATUS_INDEX=True)
+class PugOrUghStatusIndexTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = models.User.objects.create(username='test', password='test')
+        models.UserPref.objects.create(
+            user=self.user, gender='m,f', age='b,y,a,s', size='s,m,l,xl')
+        self.client.force_authenticate(user=self.user)
+        benchmarks.seed(dogs=200, users=1, swipes=0)
+        self.dog_ids = list(models.Dog.objects.order_by('id')
+                            .values_list('id', flat=True))
+        self.client.post(reverse('UpdateStatuses'), [
+            {'dog': dog_id, 'status': status}
+            for dog_id, status in zip(self.dog_ids[::2],
+                                      itertools.cycle(('liked', 'disliked')))
+        ], format='json')
+
+    def list_ids(self, status, **params):
+        response = self.client.get(
+            reverse('ListDogsStatus', kwargs={'status': status}), params)
+        results = response.data
+        if isinstance(results, dict):
+            results = results['results']
+        return [dog['id'] for dog in results]
+
+    def test_lists_match_the_database(self):
+        """ Test that the index lists and pages the same dogs as the
+        joined queries. """
+
+        for status_name in ('liked', 'disliked', 'undecided'):
+            for params in ({}, {'page_size': 7},
+                           {'after': self.dog_ids[50], 'page_size': 30}):
+                with self.settings(STATUS_INDEX=False):
+                    expected = self.list_ids(status_name, **params)
+                if not params:
+                    # Whole lists from the database are in no set order
+                    expected.sort()
+                self.assertEqual(self.list_ids(status_name, **params),
+                                 expected)
+
+    def test_swipes_update_the_index_in_place(self):
+        """ Test that a swipe is applied to the index without reloading
+        it. """
+
+        self.list_ids('liked')
+        self.client.put(reverse('UpdateStatus', kwargs={
+            'pk': self.dog_ids[1], 'status': 'liked'}))
+
+        with CaptureQueriesContext(connection) as context:
+            liked = self.list_ids('liked')
+        self.assertIn(self.dog_ids[1], liked)
+        self.assertFalse([query for query in context
+                          if 'pugorugh_userdog' in query['sql']])
+
+    def test_statuses_saved_elsewhere_are_loaded(self):
+        """ Test that a status saved around the views reloads the
+        user's copy. """
+
+        self.list_ids('liked')
+        models.UserDog.objects.create(user=self.user, dog_id=self.dog_ids[3],
+                                      status='l')
+
+        self.assertIn(self.dog_ids[3], self.list_ids('liked'))
+        self.assertNotIn(self.dog_ids[3], self.list_ids('undecided'))
+
+    def test_next_liked_dog(self):
+        """ Test that the next liked dog comes from the index. """
+
+        response = self.client.get(reverse('NextDog', kwargs={
+            'pk': self.dog_ids[0], 'status': 'liked'}))
+
+        self.assertEqual(response.data['id'], self.dog_ids[4])
+
+
+class PugOrUghAdminTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.admin = models.User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        benchmarks.seed(dogs=100, users=1, swipes=0)
+        self.users = [models.User.objects.create(username='user{}'.format(number))
+                      for number in range(3)]
+        self.dog_ids = list(models.Dog.objects.order_by('id')
+                            .values_list('id', flat=True))
+
+    def add_user_dogs(self, count):
+        models.UserDog.objects.bulk_create([
+            models.UserDog(user=user, dog_id=dog_id, status='l')
+            for user in self.users for dog_id in self.dog_ids
+        ][models.UserDog.objects.count():count])
+
+    def get_changelist(self, model, params=None):
+        url = reverse('admin:pugorugh_{}_changelist'.format(model))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(context)
+
+    def test_userdog_query_count_is_constant(self):
+        """ Test that the UserDog list runs the same queries for a few
+        rows and for a full page. """
+
+        query_counts = []
+        for count in (5, 100, 300):
+            self.add_user_dogs(count)
+            response, queries = self.get_changelist('userdog')
+            self.assertEqual(response.context['cl'].result_count, count)
+            query_counts.append(queries)
+
+        self.assertEqual(len(set(query_counts)), 1)
+
+    def test_big_tables_are_estimated(self):
+        """ Test that a big unfiltered list is not counted exactly. """
+
+        self.add_user_dogs(300)
+        with mock.patch.object(pug_admin.EstimatedCountPaginator,
+                               'exact_below', 10):
+            response, queries = self.get_changelist('userdog')
+
+        self.assertEqual(response.context['cl'].result_count,
+                         models.UserDog.objects.order_by('-id')
+                         .values_list('id', flat=True).first())
+
+    def test_filtered_count_is_capped(self):
+        """ Test that a filtered list is counted up to the cap. """
+
+        with mock.patch.object(pug_admin.EstimatedCountPaginator,
+                               'max_count', 5):
+            response, queries = self.get_changelist(
+                'dog', {'age_stage__exact': 'a'})
+
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+
+class PugOrUghMetricsTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        metrics.registry.reset()
+        self.user = models.User.objects.create(username='test', password='test')
+        self.client.force_authenticate(user=self.user)
+        benchmarks.seed(dogs=10, users=1, swipes=0)
+
+    def test_requests_are_recorded_by_route(self):
+        """ Test that the metrics count requests, queries and time per
+        route. """
+
+        self.client.get(reverse('ListDogs'))
+        self.client.get(reverse('ListDogs'))
+        self.client.get(reverse('DogStatusSummary'))
+
+        route = metrics.registry.routes['ListDogs']
+        self.assertEqual(route.count, 2)
+        self.assertEqual(route.requests[('GET', 200)], 2)
+        self.assertGreater(route.queries, 0)
+        self.assertGreater(route.sql_seconds, 0)
+        self.assertGreater(route.render_seconds, 0)
+        self.assertEqual(route.n_plus_one, 0)
+        self.assertEqual(metrics.registry.routes['DogStatusSummary'].count, 1)
+
+    def test_prometheus_text(self):
+        """ Test that the metrics are served in the Prometheus text
+        format. """
+
+        self.client.get(reverse('ListDogs'))
+
+        response = Client().get(reverse('Metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('pugorugh_requests_total{route="ListDogs",method="GET",'
+                      'status="200"} 1', body)
+        self.assertIn('pugorugh_request_duration_seconds_count'
+                      '{route="ListDogs"} 1', body)
+        self.assertIn('# TYPE pugorugh_n_plus_one_total counter', body)
+
+    def test_metrics_are_local_only(self):
+        """ Test that other addresses cannot read the metrics. """
+
+        response = Client(REMOTE_ADDR='10.0.0.1').get(reverse('Metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_n_plus_one_is_flagged(self):
+        """ Test that a request running one query per dog is flagged. """
+
+        dog_ids = list(models.Dog.objects.values_list('id', flat=True))
+
+        def get_response(request):
+            request.resolver_match = get_resolver().resolve(
+                reverse('ListDogs'))
+            for dog_id in dog_ids:
+                models.Dog.objects.filter(id=dog_id).first()
+            return HttpResponse()
+
+        request = RequestFactory().get(reverse('ListDogs'))
+        with self.assertLogs('pugorugh.metrics', 'WARNING') as logs:
+            middleware.RequestMetricsMiddleware(get_response)(request)
+
+        self.assertIn('Possible N+1 query on ListDogs, run 10 times',
+                      logs.output[0])
+        self.assertEqual(metrics.registry.routes['ListDogs'].n_plus_one, 1)
+
+    def test_query_lists_have_one_shape(self):
+        """ Test that queries differing only in their id lists match. """
+
+        self.assertEqual(
+            metrics.query_shape('SELECT 1 WHERE id IN (%s, %s, %s)'),
+            metrics.query_shape('SELECT 1 WHERE id IN (%s)'))
+
+
+# Run in a fresh process with a primary and a replica SQLite file. The
+# replica is a copy of the primary taken before the swipe, like one
+# lagging behind.
+REPLICA_SCRIPT = """
+import json
+import shutil
+import sys
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from pugorugh import benchmarks, models, routers
+
+setup_test_environment()
+primary, replica, step = sys.argv[1:]
+
+if step == 'swipe':
+    call_command('migrate', verbosity=0)
+    with routers.use_primary():
+        benchmarks.seed(dogs=20, users=2, swipes=0)
+    connections.close_all()
+    shutil.copy(primary, replica)
+
+with routers.use_primary():
+    tokens = dict(Token.objects.values_list('user__username', 'key'))
+    dog_id = models.Dog.objects.order_by('id').values_list('id', flat=True)[0]
+    swiper = models.User.objects.get(username='bench0').id
+
+def client(username):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + tokens[username])
+    return client
+
+def liked(username):
+    with CaptureQueriesContext(connections['replica1']) as context:
+        response = client(username).get(
+            reverse('ListDogsStatus', kwargs={'status': 'liked'}))
+    return [dog['id'] for dog in response.data], len(context)
+
+if step == 'swipe':
+    client('bench0').put(reverse('UpdateStatus', kwargs={
+        'pk': dog_id, 'status': 'liked'}))
+    sys.exit()
+
+report = {'dog': dog_id, 'pinned': liked('bench0'), 'other': liked('bench1')}
+routers.last_write_cache().delete(routers.LAST_WRITE_KEY.format(swiper))
+report['unpinned'] = liked('bench0')
+
+anonymous = APIClient()
+anonymous.post(reverse('register-user'),
+               {'username': 'new', 'password': 'password'}, format='json')
+token = anonymous.post(reverse('login-user'),
+                       {'username': 'new', 'password': 'password'},
+                       format='json').data['token']
+anonymous.credentials(HTTP_AUTHORIZATION='Token ' + token)
+report['new_user'] = anonymous.get(reverse('DogStatusSummary')).status_code
+print(json.dumps(report))
+"""
+
+# Caches two server processes can share
+SHARED_CACHE_SETTINGS = """
+from backend.settings import *
+
+CACHES = {{
+    alias: {{
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': {directory!r} + '/cache-' + alias,
+    }}
+    for alias in ('default', 'dogs', 'stamps')
+}}
+"""
+
+
+class PugOrUghReplicaTests(SimpleTestCase):
+    def test_reads_go_to_the_replica_after_the_pin(self):
+        """ Test that a user reads their own swipe from the primary, even
+        in another server process, and from the replica once the pin is
+        over. """
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = path.join(directory, 'primary.sqlite3')
+        replica = path.join(directory, 'replica.sqlite3')
+        with open(path.join(directory, 'shared_settings.py'), 'w') as file:
+            file.write(SHARED_CACHE_SETTINGS.format(directory=directory))
+
+        PROJ_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+        env = dict(os.environ, DJANGO_DB_PROFILE='sqlite',
+                   DJANGO_SQLITE_PATH=primary,
+                   DJANGO_SQLITE_REPLICA_PATHS=replica,
+                   DJANGO_SETTINGS_MODULE='shared_settings',
+                   PYTHONPATH=directory, WEB_CONCURRENCY='2')
+        # The swipe and the reads are served by different processes
+        for step in ('swipe', 'read'):
+            output = subprocess.check_output(
+                [sys.executable, '-c', REPLICA_SCRIPT, primary, replica,
+                 step], cwd=PROJ_DIR, timeout=300, env=env)
+        report = json.loads(output.decode())
 
+        # The swipe is read back from the primary
+        self.assertEqual(report['pinned'], [[report['dog']], 0])
+        # Other users and, after the pin, the swiper read the replica
+        self.assertEqual(report['other'][0], [])
+        self.assertGreater(report['other'][1], 0)
+        self.assertEqual(report['unpinned'][0], [])
+        self.assertGreater(report['unpinned'][1], 0)
+        # A brand new token is found on the primary
+        self.assertEqual(report['new_user'], 200)
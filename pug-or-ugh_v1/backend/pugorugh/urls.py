@@ -6,8 +6,10 @@ from rest_framework.urlpatterns import format_suffix_patterns
 from rest_framework.authtoken.views import obtain_auth_token
 
 from pugorugh.views import (UserRegisterView, api_root, CreateUpdateViewUserPref,
-                            UpdateStatus, NextDogView, 
-                            ListDogsView, ListDogsStatusView)
+                            UpdateStatus, UpdateStatuses, NextDogView,
+                            ListDogsView, ListDogsStatusView,
+                            DogCacheStatsView, DogStatusSummaryView,
+                            SearchDogsView, metrics_view)
 
 from . import views
 
@@ -18,6 +20,8 @@ urlpatterns = format_suffix_patterns([
     url(r'^api/user/$', UserRegisterView.as_view(), name='register-user'),
     url(r'^api/user/preferences/$', 
         CreateUpdateViewUserPref.as_view(), name='user-pref'), 
+    url(r'^api/dog/statuses/$',
+        UpdateStatuses.as_view(), name='UpdateStatuses'),
     url(r'^api/dog/(?P<pk>-?\d+)/(?P<status>[\w\-]+)/$',
         UpdateStatus.as_view(), name='UpdateStatus'),
     url(r'^api/dog/(?P<pk>-?\d+)/(?P<status>[\w\-]+)/next/$',
@@ -26,8 +30,15 @@ urlpatterns = format_suffix_patterns([
      #   UpdateUndecided.as_view(), name='UpdateUndecided'),   
     url(r'^api/dogs/$', 
         ListDogsView.as_view(), name='ListDogs'),
+    url(r'^api/dogs/summary/$',
+        DogStatusSummaryView.as_view(), name='DogStatusSummary'),
+    url(r'^api/dogs/search/$',
+        SearchDogsView.as_view(), name='SearchDogs'),
     url(r'api/dogs/(?P<status>[\w\-]+)/$',
         ListDogsStatusView.as_view(), name='ListDogsStatus'),   
+    url(r'^api/stats/dog-cache/$',
+        DogCacheStatsView.as_view(), name='DogCacheStats'),
+    url(r'^api/stats/metrics/$', metrics_view, name='Metrics'),
     url(r'^favicon\.ico$',
         RedirectView.as_view(
             url='/static/icons/favicon.ico',
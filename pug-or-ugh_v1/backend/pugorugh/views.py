@@ -1,9 +1,10 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import Http404
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 
 from rest_framework import permissions
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (CreateAPIView, ListAPIView,
@@ -16,11 +17,21 @@ from rest_framework import status as api_status
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
-from django.db.models import Q
+from django.db import transaction
 from django.contrib.auth.models import User
 
+from . import candidates
+from .authentication import CachedTokenAuthentication
+from .conditional import ConditionalGetMixin
+from . import dog_cache
+from . import metrics
 from . import models
+from . import ranking
+from . import search
 from . import serializers
+from . import status_index
+from .pagination import (DogKeysetPagination, DogSearchPagination,
+                         StreamingListMixin)
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -34,17 +45,20 @@ class UserRegisterView(CreateAPIView):
     serializer_class = serializers.UserSerializer
     
 #/api/user/preferences/    
-class CreateUpdateViewUserPref(RetrieveUpdateAPIView, CreateModelMixin):
+class CreateUpdateViewUserPref(ConditionalGetMixin, RetrieveUpdateAPIView,
+                               CreateModelMixin):
     """Create, update, or view user preferences."""
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     queryset = models.UserPref.objects.all()
     serializer_class = serializers.UserPrefSerializer
 
     lookup_field = None
-    
+
+    def get_versions(self, request):
+        return (models.user_pref_version(request.user.id),)
     
     def get_object(self):
         try:
@@ -55,6 +69,10 @@ class CreateUpdateViewUserPref(RetrieveUpdateAPIView, CreateModelMixin):
             
             
         return user_pref
+
+    def perform_update(self, serializer):
+        serializer.save()
+        candidates.clear(self.request.user)
         
 
     
@@ -64,34 +82,86 @@ class UpdateStatus(APIView):
     """ This view updates a dog's status to liked or disliked. """ 
     
     def put(self, request, pk, status, format=None):
+        if status not in ['liked', 'disliked', 'undecided']:
+            return Response(
+                {'status': ['Must be liked, disliked, or undecided.']},
+                status=api_status.HTTP_400_BAD_REQUEST)
+
         status_choice = None
         
         for choice in models.UserDog.STATUS_CHOICES:
             if choice[1].lower() == status:
                 status_choice = choice[0]
         
-        serializer = serializers.UserDogSerializer(
-            data={'user': self.request.user.id, 'dog': pk, 'status': status_choice})
-        if serializer.is_valid():
-            try:
-                user_dog = models.UserDog.objects.get(user=self.request.user.id, dog=pk)
-                user_dog.status = status_choice
-            except models.UserDog.DoesNotExist:
-                user_dog = models.UserDog.objects.create(**serializer.validated_data)
-            user_dog.save()
-            
-            return Response(serializer.data, status=api_status.HTTP_200_OK)
-        return Response(serializer.errors, status=api_status.HTTP_400_BAD_REQUEST)
+        if not models.UserDog.objects.set_status(
+                self.request.user, pk, status_choice):
+            return Response(
+                {'dog': ['Invalid pk "{}" - object does not exist.'.format(pk)]},
+                status=api_status.HTTP_400_BAD_REQUEST)
+        candidates.status_changed(self.request.user, int(pk), status_choice)
+        status_index.statuses_changed(self.request.user,
+                                      {int(pk): status_choice})
+
+        return Response({'dog': int(pk), 'status': status_choice},
+                        status=api_status.HTTP_200_OK)
     
+#/api/dog/statuses/
+class UpdateStatuses(APIView):
+    """ This view records a batch of swipes, such as ones queued by an
+    offline client. """
+
+    max_batch_size = 500
+
+    def post(self, request, format=None):
+        serializer = serializers.StatusDecisionSerializer(
+            data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=api_status.HTTP_400_BAD_REQUEST)
+        decisions = serializer.validated_data
+        if len(decisions) > self.max_batch_size:
+            return Response(
+                {'non_field_errors': ['At most {} swipes per batch.'.format(
+                    self.max_batch_size)]},
+                status=api_status.HTTP_400_BAD_REQUEST)
+
+        status_codes = {name.lower(): code
+                        for code, name in models.UserDog.STATUS_CHOICES}
+        dog_ids = {decision['dog'] for decision in decisions}
+        existing = set(models.Dog.objects.filter(id__in=dog_ids)
+                       .values_list('id', flat=True))
+
+        # Later swipes on the same dog win
+        statuses = {}
+        results = []
+        for decision in decisions:
+            status_choice = status_codes.get(decision['status'])
+            if decision['dog'] in existing:
+                statuses[decision['dog']] = status_choice
+                results.append({'dog': decision['dog'],
+                                'status': status_choice})
+            else:
+                results.append({'dog': decision['dog'],
+                                'status': status_choice,
+                                'error': 'Dog does not exist.'})
+
+        with transaction.atomic():
+            models.UserDog.objects.set_statuses(self.request.user, statuses)
+        candidates.statuses_changed(self.request.user, statuses)
+        status_index.statuses_changed(self.request.user, statuses)
+
+        return Response(results, status=api_status.HTTP_200_OK)
+
 # /api/dog/(?P<pk>-?\d+)/(?P<status>[\w\-]+)/next/
 class NextDogView(RetrieveAPIView, CreateModelMixin):
     """ This view gets you the next dog associated with its status. """
     
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
     serializer_class = serializers.DogSerializer
     queryset = models.Dog.objects.all()
+    max_prefetch = 10
     
     @property
     def given_status(self):
@@ -120,74 +190,178 @@ class NextDogView(RetrieveAPIView, CreateModelMixin):
 
             user_pref = self.request.user.userpref_set.get()
 
-            available_dogs = self.queryset.filter(
-                gender__in=user_pref.gender.split(","),
-                size__in=user_pref.size.split(","),
-                age__in=user_pref.ages_int_range,
-            )
+            available_dogs = self.queryset.matching(user_pref)
             
         else:
             available_dogs = self.queryset
 
-        return available_dogs.filter(
-            userdog__status=self.given_status,
-            userdog__user__id=self.request.user.id, 
-            id__gt=self.kwargs.get('pk')
-        )
+        return available_dogs.with_status(
+            self.request.user, self.given_status
+        ).filter(id__gt=self.kwargs.get('pk')).order_by('id')
     
-    def get_object(self):
-        """Find the first dog in the queryset or give a 404 if there is none"""
+    def get_prefetch(self):
+        """How many dogs after the next one the client asked to preload"""
 
-        queryset = self.get_queryset()
-        
-        
-        if len(queryset) == 1:
-            dog = queryset[0]
-        else:
-            dog = self.get_queryset().first()
-            
-        if not dog:
-            dogs = models.Dog.objects.all()
-            for dog in dogs:
-                dog = models.UserDog.objects.create(
-                    user=self.request.user,
-                    dog=dog,
-                    status=None
-                )
-            
-        
+        try:
+            prefetch = int(self.request.query_params.get('prefetch', 0))
+        except ValueError:
+            raise ValidationError('Prefetch must be a whole number.')
+        return max(0, min(prefetch, self.max_prefetch))
 
-        
+    @property
+    def ranked(self):
+        """Whether the client asked for undecided dogs best match first"""
+
+        order = self.request.query_params.get('order', 'id')
+        if order not in ('id', 'ranked'):
+            raise ValidationError('Order must be id or ranked.')
+        return order == 'ranked' and ranking.available()
+
+    def get_dog_ids(self, count):
+        """Find the ids of up to count next dogs"""
+
+        if self.given_status:
+            statuses = status_index.get(self.request.user)
+            if statuses is not None:
+                return statuses.ids_after(self.given_status,
+                                          int(self.kwargs.get('pk')), count)
+            return list(self.get_queryset().values_list('id', flat=True)[:count])
+
+        if self.ranked:
+            return candidates.ranked_dog_ids(
+                self.request.user, int(self.kwargs.get('pk')), count)
 
-        return dog
+        # Undecided dogs are served from the user's candidate queue
+        return candidates.next_dog_ids(self.request.user,
+                                       int(self.kwargs.get('pk')), count)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Give the next dog's cached payload or a 404 if there is none.
+
+        With ?prefetch=K the payloads of up to K dogs after it are included
+        as "upcoming", so the client can preload their photos.
+        """
+
+        count = self.get_prefetch() + 1
+        dog_ids = self.get_dog_ids(count)
+        payloads = dog_cache.get_payloads(dog_ids)
+        if (len(payloads) < len(dog_ids) and not self.given_status and
+                not self.ranked):
+            # A queued dog was deleted, so start the queue over
+            candidates.clear(request.user)
+            payloads = dog_cache.get_payloads(self.get_dog_ids(count))
+        if not payloads:
+            raise Http404
+
+        if 'prefetch' not in request.query_params:
+            return Response(payloads[0])
+        return Response(dict(payloads[0], upcoming=payloads[1:]))
     
 # /api/dog/<pk>/undecided/
 class UpdateUndecided(DestroyAPIView):
     """ This view deletes a dog's status. """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.DogSerializer
     queryset = models.Dog.objects.all()    
 
+class DogPayloadListMixin:
+    """ Lists dogs from the payload cache, reading only ids from the
+    database. """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset.only('id'))
+        if page is not None:
+            payloads = dog_cache.get_payloads([dog.id for dog in page])
+            return self.get_paginated_response(payloads)
+
+        return Response(
+            dog_cache.get_payloads(queryset.values_list('id', flat=True)))
+
+
+#/api/dogs/summary/
+class DogStatusSummaryView(APIView):
+    """ This view counts the user's liked, disliked and undecided dogs
+    without reading their UserDog rows. """
+
+    def get(self, request, format=None):
+        counts = (models.UserStatusCount.objects.filter(user=request.user)
+                  .values('liked', 'disliked').first()
+                  or {'liked': 0, 'disliked': 0})
+        counts['undecided'] = max(0, models.Dog.objects.catalog_size() -
+                                  counts['liked'] - counts['disliked'])
+        return Response(counts)
+
+
+#/api/dogs/search/
+class SearchDogsView(APIView):
+    """ This view finds dogs by breed, name or both, with the gender, size
+    and age filters of the user preferences, a page at a time. """
+
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    pagination_class = DogSearchPagination
+
+    def get(self, request, format=None):
+        serializer = serializers.DogSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=api_status.HTTP_400_BAD_REQUEST)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_ids(
+            search.search(**serializer.validated_data), request, self)
+        return paginator.get_paginated_response(dog_cache.get_payloads(page))
+
+
+#/api/stats/dog-cache/
+class DogCacheStatsView(APIView):
+    """ This view shows the dog payload cache hits and misses. """
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(dict(dog_cache.stats))
+
+#/api/stats/metrics/
+def metrics_view(request, format=None):
+    """ This view serves the request metrics of this process to
+    Prometheus, from the addresses in METRICS_ALLOWED_IPS only. """
+
+    if request.META.get('REMOTE_ADDR') not in getattr(
+            settings, 'METRICS_ALLOWED_IPS', ()):
+        raise PermissionDenied
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # /api/dogs/
-class ListDogsView(ListCreateAPIView):
+class ListDogsView(ConditionalGetMixin, StreamingListMixin,
+                   DogPayloadListMixin, ListCreateAPIView):
     """ This view lists all dog objects """
     
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
     serializer_class = serializers.DogSerializer
+    pagination_class = DogKeysetPagination
     queryset = models.Dog.objects.all()
 
+    def get_versions(self, request):
+        return (models.catalog_versions()[0],)
+
 #/api/dogs/(?P<status>[\w\-]+)/
-class ListDogsStatusView(ListAPIView):
+class ListDogsStatusView(ConditionalGetMixin, StreamingListMixin,
+                         DogPayloadListMixin, ListAPIView):
     """ This view displays all dogs based on a liked,
     disliked, undecided filter 
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
     serializer_class = serializers.DogSerializer
+    pagination_class = DogKeysetPagination
     queryset = models.Dog.objects.all()
     
     @property
@@ -211,14 +385,36 @@ class ListDogsStatusView(ListAPIView):
         return status
 
     
+    def get_versions(self, request):
+        return (models.catalog_versions()[0],
+                models.user_status_version(request.user.id))
+
     def get_queryset(self):
         """Return a queryset based on dog pk and the user dog's status."""
         
-        return self.queryset.filter(
-            Q(userdog__status=self.given_status) &
-            Q(userdog__user__id=self.request.user.id) 
+        return self.queryset.with_status(
+            self.request.user, self.given_status
         )
 
+    def list(self, request, *args, **kwargs):
+        """List the dogs from the status index, when it is on, instead of
+        joining the dogs to the user's statuses."""
+
+        statuses = status_index.get(request.user)
+        if statuses is None or self.is_streaming(request):
+            return super(ListDogsStatusView, self).list(
+                request, *args, **kwargs)
+
+        given_status = self.given_status
+        page = self.paginator.paginate_ids(
+            lambda after, count: statuses.ids_after(given_status, after,
+                                                    count),
+            request, self)
+        if page is not None:
+            return self.get_paginated_response(dog_cache.get_payloads(page))
+        return Response(dog_cache.get_payloads(
+            statuses.ids_after(given_status, -1)))
+
 
     
     